@@ -16,6 +16,11 @@ from typing import (
     Union,
 )
 
+# Import local libraries
+# pylint: disable=relative-beyond-top-level
+from .SimulationCounts import SimulationCounts
+from .Trace import SOURCE_ACTIVITY
+
 
 class ActivityBase():
     """Person's activity within the system, models interaction between people and environment """
@@ -57,20 +62,23 @@ class ActivityBase():
         success_message: ended
     """), Loader=yaml.SafeLoader)
 
-    def __init__(self, simulation_params, **kwargs) -> None:
+    def __init__(self, simulation_params, context, **kwargs) -> None:
         """Create a new activity
 
         Arguments:
             simulation_params {dictionary} -- keyword arguments for the simulation
-            kwargs {dictionary} -- Keyword arguments for the activity
+            context {ActivityContext} -- The person and communication pipes for this activity
+            kwargs {dictionary} -- Keyword arguments registered for the activity
         """
         self.env = simulation_params.get('simpy_env', None)
         self.dc = simulation_params.get('data_collector', None)
         self.time_interval = simulation_params.get('time_interval', None)
+        self.tracer = simulation_params.get('trace_recorder', None)
 
-        self.person = kwargs['person']
-        self.message_to_activity = kwargs['message_to_activity']
-        self.message_to_person = kwargs['message_to_person']
+        self.person = context.person
+        self.activity_name = context.activity.activity_name
+        self.message_to_activity = context.message_to_activity
+        self.message_to_person = context.message_to_person
 
         self.unpack_parameters(**kwargs)
 
@@ -93,6 +101,8 @@ class ActivityBase():
         }
 
         state = 'init'
+        counts = SimulationCounts.for_env(self.env)
+        counts.activities_active += 1
 
         finished = False
         while not finished:
@@ -106,6 +116,10 @@ class ActivityBase():
             if actions == 'NoMessage':
                 raise ValueError('Activity received message error')
 
+            if self.tracer is not None:
+                self.tracer.record(self.env.now, self.person.PID, SOURCE_ACTIVITY,
+                                   self.activity_name, state, received_message)
+
             next_state = actions['next_state']
             action = actions['function']
             success_message = actions['success_message']
@@ -113,13 +127,7 @@ class ActivityBase():
             if not function_dict.get(action, None):
                 raise ValueError(f'Activity function {action} missing')
 
-            # Check whether subclassed method is a generator, which requires
-            # different calling pattern
-            if inspect.isgeneratorfunction(function_dict.get(action)):
-                for result in function_dict.get(action)():
-                    pass
-            else:
-                function_dict.get(action)()
+            yield from self._call(function_dict.get(action))
 
             state = next_state
 
@@ -127,15 +135,27 @@ class ActivityBase():
 
             finished = True if state == 'ended' else finished
 
+        counts.activities_active -= 1
+
+    @staticmethod
+    def _call(method):
+        """Call an action method, passing the events of a generator method on to simpy"""
+        # Check whether subclassed method is a generator, which requires
+        # different calling pattern (the events it yields are passed on to simpy)
+        if inspect.isgeneratorfunction(method):
+            yield from method()
+        else:
+            method()
+
     def nop(self) -> None:
         pass
 
     def initialise(self) -> None:
         pass
 
-    def seize_resources_and_execute(self) -> None:
-        self.seize_resources()
-        self.execute()
+    def seize_resources_and_execute(self):
+        yield from self._call(self.seize_resources)
+        yield from self._call(self.execute)
 
     def seize_resources(self) -> None:
         pass
@@ -143,9 +163,9 @@ class ActivityBase():
     def execute(self) -> None:
         pass
 
-    def release_resources_and_end(self) -> None:
-        self.release_resources()
-        self.end()
+    def release_resources_and_end(self):
+        yield from self._call(self.release_resources)
+        yield from self._call(self.end)
 
     def release_resources(self) -> None:
         pass
@@ -0,0 +1,91 @@
+""" HealthDES - A python library to support discrete event simulation in health and social care """
+
+import simpy
+import weakref
+
+
+class ActivityContext:
+    """ Runtime context for one person performing one activity
+
+    The activity (an Activity_ID) and its registered arguments are shared by everyone routed
+    through it; the context holds the per-person state: the person and the two communication
+    pipes between the person and the activity instance.
+    """
+    __slots__ = ['activity', 'person', 'message_to_activity', 'message_to_person']
+
+    def __init__(self, env):
+        self.activity = None
+        self.person = None
+        self.message_to_activity = simpy.Store(env)
+        self.message_to_person = simpy.Store(env)
+
+
+class ActivityContextPool:
+    """ Pool of activity contexts, recycled when activities end
+
+    Creating a context allocates two simpy.Store pipes. Contexts are returned to the pool by the
+    person once the activity has ended, so a long simulation only allocates as many contexts as
+    there are activities running at the same time.
+    """
+
+    # One pool for each simpy environment
+    _pools = weakref.WeakKeyDictionary()
+
+    def __init__(self, env):
+        """Create an empty pool
+
+        Arguments:
+            env {simpy.Environment} -- The environment the pipes belong to
+        """
+        self.env = env
+        self.free = []
+        self.in_use = 0
+
+    @classmethod
+    def for_env(cls, env):
+        """Return the pool for a simpy environment, creating it if needed
+
+        Arguments:
+            env {simpy.Environment} -- The simpy environment
+
+        Returns:
+            ActivityContextPool -- The pool for the environment
+        """
+        pool = cls._pools.get(env, None)
+        if pool is None:
+            pool = cls(env)
+            cls._pools[env] = pool
+        return pool
+
+    def acquire(self, person, activity):
+        """Get a context for a person to perform an activity
+
+        Arguments:
+            person {PersonBase} -- The person performing the activity
+            activity {Activity_ID} -- The activity
+
+        Returns:
+            ActivityContext -- Context holding empty communication pipes
+        """
+        context = self.free.pop() if self.free else ActivityContext(self.env)
+        context.activity = activity
+        context.person = person
+        self.in_use += 1
+        return context
+
+    def release(self, context):
+        """Return a context to the pool once its activity has ended
+
+        Contexts with messages or requests still pending on their pipes are not reused.
+
+        Arguments:
+            context {ActivityContext} -- The context to release
+        """
+        self.in_use -= 1
+        context.person = None
+
+        for pipe in (context.message_to_activity, context.message_to_person):
+            if pipe.items or pipe.get_queue or pipe.put_queue:
+                return
+
+        self.free.append(context)
@@ -1,4 +1,9 @@
 """ HealthDES - A python library to support discrete event simulation in health and social care """
+import numbers
+
+import numpy as np
+import pandas as pd
+
 from typing import (
     TYPE_CHECKING,
     ClassVar,
@@ -12,6 +17,11 @@ from typing import (
 )
 
 
+def _is_number(x) -> bool:
+    """Return True if x is an int or float, including NumPy scalars, but not a bool"""
+    return isinstance(x, numbers.Real) and not isinstance(x, (bool, np.bool_))
+
+
 class Check:
     """ Class containing functions to check whether values meet certain conditions
 
@@ -28,10 +38,10 @@ class Check:
             x (int or float): The variable to be tested.
 
         Raises:
-            ValueError: The variable is not an int or float.
+            ValueError: The variable is not an int or float (Python or NumPy).
             ValueError: The variable is not equal to zero.
         """
-        if not(type(x) is int or type(x) is float):
+        if not _is_number(x):
             raise ValueError('value must be a number')
         if not (x == 0):
             raise ValueError('value must be equal to zero')
@@ -44,10 +54,10 @@ class Check:
             x (int or float): The variable to be tested.
 
         Raises:
-            ValueError: The variable is not an int or float.
+            ValueError: The variable is not an int or float (Python or NumPy).
             ValueError: The variable is equal to zero.
         """
-        if not(type(x) is int or type(x) is float):
+        if not _is_number(x):
             raise ValueError('value must be a number')
         if not (x != 0):
             raise ValueError('value must not equal zero')
@@ -60,10 +70,10 @@ class Check:
             x (int or float): The variable to be tested.
 
         Raises:
-            ValueError: The variable is not an int or float.
+            ValueError: The variable is not an int or float (Python or NumPy).
             ValueError: The variable is not greater than zero.
         """
-        if not(type(x) is int or type(x) is float):
+        if not _is_number(x):
             raise ValueError('value must be a number')
         if not (x > 0):
             raise ValueError('value must be greater than zero')
@@ -76,10 +86,10 @@ class Check:
             x (int or float): The variable to be tested.
 
         Raises:
-            ValueError: The variable is not an int or float.
+            ValueError: The variable is not an int or float (Python or NumPy).
             ValueError: The variable is not greater than or equal to zero.
         """
-        if not(type(x) is int or type(x) is float):
+        if not _is_number(x):
             raise ValueError('value must be a number')
         if not (x >= 0):
             raise ValueError('value must be greater than, or equal to, zero')
@@ -92,10 +102,10 @@ class Check:
             x (int or float): The variable to be tested.
 
         Raises:
-            ValueError: The variable is not an int or float.
+            ValueError: The variable is not an int or float (Python or NumPy).
             ValueError: The variable is not less than zero.
         """
-        if not(type(x) is int or type(x) is float):
+        if not _is_number(x):
             raise ValueError('value must be a number')
         if not (x < 0):
             raise ValueError('value must be less than zero')
@@ -108,10 +118,10 @@ class Check:
             x (int or float): The variable to be tested.
 
         Raises:
-            ValueError: The variable is not an int or float.
+            ValueError: The variable is not an int or float (Python or NumPy).
             ValueError: The variable is not less than or equal to zero.
         """
-        if not(type(x) is int or type(x) is float):
+        if not _is_number(x):
             raise ValueError('value must be a number')
         if not (x <= 0):
             raise ValueError('value must be less than, or equal to, zero')
@@ -166,6 +176,20 @@ class CheckList:
         if not in_list:
             raise ValueError('Item not in list')
 
+    @staticmethod
+    def fail_if_not_in_set(test_item, set_of_items):
+        """Check whether an item is in a set, a constant time alternative to fail_if_not_in_list
+
+        Args:
+            test_item (obj): Item to be checked against the set
+            set_of_items (set or frozenset): Set potentially containing the item
+
+        Raises:
+            ValueError: The item is not in the set
+        """
+        if test_item not in set_of_items:
+            raise ValueError('Item not in set')
+
     @staticmethod
     def is_a_dictionary(di):
         """Check whether item is a dictionary
@@ -205,3 +229,217 @@ class CheckList:
         """
         if test_key in di:
             raise ValueError('Cannot have duplicate keys in dictionary')
+
+
+class ArrayCheckError(ValueError):
+    """ Error raised by CheckArray listing every value which failed a check
+
+    Attributes:
+        failures (list): (description, indices) for each failed check. Indices are index labels
+                         for pandas objects and positions for other arrays.
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+        messages = []
+        for description, indices in failures:
+            shown = ', '.join(str(i) for i in indices[:10])
+            more = f' and {len(indices) - 10} more' if len(indices) > 10 else ''
+            messages.append(f'{description} at {len(indices)} indices: {shown}{more}')
+        super().__init__('; '.join(messages))
+
+    @property
+    def indices(self):
+        """Indices which failed any check"""
+        return pd.unique(np.concatenate([np.asarray(indices) for _, indices in self.failures]))
+
+
+class CheckArray:
+    """ Class containing vectorised checks on arrays, pandas Series and DataFrame columns
+
+    These are counterparts of the Check and CheckList functions for large input datasets, such as
+    imported parameter tables. Each check evaluates a NumPy predicate over the whole array in one
+    pass and raises an ArrayCheckError (a ValueError) reporting every offending index. Missing
+    values (NaN) fail the comparison checks.
+    """
+
+    @staticmethod
+    def _as_array(x):
+        """Return the values of x as a NumPy array and the labels used to report indices"""
+        if isinstance(x, (pd.Series, pd.Index)):
+            return x.to_numpy(), x.index if isinstance(x, pd.Series) else None
+        return np.asarray(x), None
+
+    @staticmethod
+    def _fail_where(x, failed, description):
+        """Raise an ArrayCheckError if any element of the boolean mask 'failed' is set"""
+        positions = np.flatnonzero(failed)
+        if len(positions):
+            _, labels = CheckArray._as_array(x)
+            indices = labels[positions].to_numpy() if labels is not None else positions
+            raise ArrayCheckError([(description, indices)])
+
+    @staticmethod
+    def is_a_number(x) -> None:
+        """Check that an array contains numbers
+
+        Args:
+            x (array-like): The values to be tested.
+
+        Raises:
+            ValueError: The values are not ints or floats.
+        """
+        values, _ = CheckArray._as_array(x)
+        if values.dtype.kind not in 'iuf':
+            raise ValueError('values must be numbers')
+
+    @staticmethod
+    def _compare(x, predicate, description):
+        """Check that every value of a numeric array satisfies the predicate"""
+        CheckArray.is_a_number(x)
+        values, _ = CheckArray._as_array(x)
+        with np.errstate(invalid='ignore'):
+            CheckArray._fail_where(x, ~predicate(values), description)
+
+    @staticmethod
+    def is_equal_to_zero(x) -> None:
+        """Check that every value is equal to zero.
+
+        Args:
+            x (array-like): The values to be tested.
+
+        Raises:
+            ValueError: The values are not ints or floats.
+            ArrayCheckError: Values are not equal to zero.
+        """
+        CheckArray._compare(x, lambda v: v == 0, 'value must be equal to zero')
+
+    @staticmethod
+    def is_not_equal_to_zero(x) -> None:
+        """Check that no value is equal to zero.
+
+        Args:
+            x (array-like): The values to be tested.
+
+        Raises:
+            ValueError: The values are not ints or floats.
+            ArrayCheckError: Values are equal to zero.
+        """
+        CheckArray._compare(x, lambda v: v != 0, 'value must not equal zero')
+
+    @staticmethod
+    def is_greater_than_zero(x) -> None:
+        """Check that every value is greater than zero.
+
+        Args:
+            x (array-like): The values to be tested.
+
+        Raises:
+            ValueError: The values are not ints or floats.
+            ArrayCheckError: Values are not greater than zero.
+        """
+        CheckArray._compare(x, lambda v: v > 0, 'value must be greater than zero')
+
+    @staticmethod
+    def is_greater_than_or_equal_to_zero(x) -> None:
+        """Check that every value is greater than or equal to zero.
+
+        Args:
+            x (array-like): The values to be tested.
+
+        Raises:
+            ValueError: The values are not ints or floats.
+            ArrayCheckError: Values are not greater than or equal to zero.
+        """
+        CheckArray._compare(x, lambda v: v >= 0, 'value must be greater than, or equal to, zero')
+
+    @staticmethod
+    def is_less_than_zero(x) -> None:
+        """Check that every value is less than zero.
+
+        Args:
+            x (array-like): The values to be tested.
+
+        Raises:
+            ValueError: The values are not ints or floats.
+            ArrayCheckError: Values are not less than zero.
+        """
+        CheckArray._compare(x, lambda v: v < 0, 'value must be less than zero')
+
+    @staticmethod
+    def is_less_than_or_equal_to_zero(x) -> None:
+        """Check that every value is less than or equal to zero.
+
+        Args:
+            x (array-like): The values to be tested.
+
+        Raises:
+            ValueError: The values are not ints or floats.
+            ArrayCheckError: Values are not less than or equal to zero.
+        """
+        CheckArray._compare(x, lambda v: v <= 0, 'value must be less than, or equal to, zero')
+
+    @staticmethod
+    def fail_if_missing(x) -> None:
+        """Check that no value is missing (None or NaN).
+
+        Args:
+            x (array-like): The values to be tested.
+
+        Raises:
+            ArrayCheckError: Values are missing.
+        """
+        CheckArray._fail_where(x, pd.isna(CheckArray._as_array(x)[0]), 'value must not be missing')
+
+    @staticmethod
+    def fail_if_not_in_set(x, allowed) -> None:
+        """Check that every value is one of a set of allowed values, using a hash based lookup.
+
+        Args:
+            x (array-like): The values to be tested.
+            allowed (iterable): The allowed values.
+
+        Raises:
+            ArrayCheckError: Values are not in the set of allowed values.
+        """
+        values, _ = CheckArray._as_array(x)
+        in_set = pd.Series(values).isin(list(allowed)).to_numpy()
+        CheckArray._fail_where(x, ~in_set, 'value not in set')
+
+    @staticmethod
+    def check_columns(df, checks) -> None:
+        """Apply checks to the columns of a DataFrame, reporting every failure together.
+
+        Args:
+            df (DataFrame): The data to be tested.
+            checks (dict): Column name -> list of checks, each a CheckArray function taking the
+                           column, e.g. {'service_time': [CheckArray.is_greater_than_zero]}.
+
+        A check which rejects the whole column, such as a comparison on a column which is not
+        numeric, is reported once against every index of the column.
+
+        Raises:
+            ValueError: A column is missing from the DataFrame.
+            ArrayCheckError: Values in one or more columns failed a check.
+        """
+        CheckList.is_a_dictionary(checks)
+
+        failures = []
+        for column, column_checks in checks.items():
+            if column not in df.columns:
+                raise ValueError(f'Column {column} not in data')
+            column_failures = set()
+            for check in column_checks:
+                try:
+                    check(df[column])
+                except ArrayCheckError as error:
+                    failures.extend((f'{column}: {description}', indices)
+                                    for description, indices in error.failures)
+                except ValueError as error:
+                    description = f'{column}: {error}'
+                    if description not in column_failures:
+                        column_failures.add(description)
+                        failures.append((description, df.index.to_numpy()))
+
+        if failures:
+            raise ArrayCheckError(failures)
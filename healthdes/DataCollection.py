@@ -1,13 +1,17 @@
 """ HealthDES - A python library to support discrete event simulation in health and social care """
 
+import math
+import numbers
+import numpy as np
 import pandas as pd  # modin
 
-from io import StringIO
-from csv import DictWriter
+from bisect import bisect_right
+from io import StringIO, SEEK_END
+from csv import writer
 
 # Import local libraries
 # pylint: disable=relative-beyond-top-level
-from .Check import CheckList
+from .Check import Check, CheckList
 
 
 class DataCollection:
@@ -19,6 +23,10 @@ class DataCollection:
     Data collection writes to an in-memory csv file, which may be converted to a pandas DataFrame
 
     """
+
+    # Aggregations supported by create_aggregated_reporting
+    AGGREGATIONS = frozenset(['count', 'sum', 'mean', 'min', 'max', 'last'])
+
     # TODO: Implement some form of memory management to flush in-memory csv to disk/database if
     #       memory tight
     # TODO: Apache Arrow: Consider using, however, doesn't always support windows.
@@ -40,8 +48,21 @@ class DataCollection:
         # All the memory tables referenced from dictionary
         self.memory_file = {}
         self.memory_writer = {}
+        self.columns = {}
+        self.column_sets = {}
+        self.row_counts = {}
+
+        # Schema and compiled row appender for reports registered with register_report
+        self.dtypes = {}
+        self.appenders = {}
+
+        # State of the current bucket for reports created with create_aggregated_reporting
+        self.aggregates = {}
         self.counters = {}
 
+        # Chunks parsed so far and the position in the memory file up to which they were parsed
+        self.materialised = {}
+
     """ Template for periodic reporting
 
     The callback function returns a dictionary of data to be included within the report.
@@ -80,22 +101,7 @@ class DataCollection:
         column_dictionary = callback()
         CheckList.is_a_dictionary(column_dictionary)
 
-        header_list = []
-        for key, _ in column_dictionary.items():
-            header_list.append(key)
-
-        header_list.insert(0, 'time')
-        header_list.insert(0, 'simulation_run')
-        header_list.insert(0, 'simulation_name')
-
-        # Create a new memory file into which data will be stored as CSV file
-        self.memory_file[data_set_name] = StringIO()
-        self.memory_writer[data_set_name] = DictWriter(self.memory_file[data_set_name],
-                                                       header_list,
-                                                       restval='Null',
-                                                       extrasaction='raise')
-
-        self.memory_writer[data_set_name].writeheader()
+        self._create_report(data_set_name, list(column_dictionary.keys()))
 
         self.env.process(self.periodic_reporting(data_set_name, callback, periods))
 
@@ -108,48 +114,302 @@ class DataCollection:
         periods                 The number of periods between fetches of data
         """
         while True:
-            data = callback()
-            data['time'] = self.env.now
-            data['simulation_run'] = self.simulation_run
-            data['simulation_name'] = self.simulation_name
-            self.memory_writer[data_set_name].writerow(data)
+            self.log_reporting(data_set_name, callback())
 
             yield self.env.timeout(periods)
 
+    def register_report(self, data_set_name, schema):
+        """ Register a report with a declared schema
+
+        The schema is compiled once into a row appender which checks the number of columns and
+        applies any value checks before appending the row. Rows for the report may then be logged
+        positionally with log_row (or the appender returned by get_row_logger), avoiding building
+        a dictionary for every row, as well as with log_reporting.
+
+        Keyword parameters:
+        data_set_name           The name for the data set to be recorded
+        schema                  Dictionary of column name -> dtype, or column name ->
+                                (dtype, list of checks). The dtype (e.g. int, float, str, 'int64')
+                                is applied when results are converted to a pandas DataFrame, and
+                                each value logged to a boolean, integer or float column is checked
+                                against it. Checks are functions that raise ValueError for an
+                                invalid value, such as Check.is_greater_than_zero.
+
+        Example:
+            dc.register_report('waits', {'pid': int,
+                                         'wait': (float, [Check.is_greater_than_or_equal_to_zero])})
+            dc.log_row('waits', person.PID, wait)
+        """
+        CheckList.fail_if_this_key_in_the_dictionary(data_set_name, self.memory_file)
+        CheckList.is_a_dictionary(schema)
+        CheckList.fail_if_dict_empty(schema)
+
+        columns = []
+        dtypes = {}
+        checks = []
+        for index, (column, definition) in enumerate(schema.items()):
+            dtype, column_checks = definition if isinstance(definition, tuple) else (definition, [])
+            CheckList.is_a_list(column_checks)
+            columns.append(column)
+            dtypes[column] = dtype
+            dtype_check = self._dtype_check(dtype)
+            if dtype_check is not None:
+                checks.append((index, column, dtype_check))
+            checks.extend((index, column, check) for check in column_checks)
+
+        self._create_report(data_set_name, columns)
+        self.dtypes[data_set_name] = dtypes
+        self.appenders[data_set_name] = self._compile_appender(data_set_name, columns, checks)
+
+    @staticmethod
+    def _dtype_check(dtype):
+        """ Return a check that a value can be read back with a dtype, None if any value can
+
+        Values are checked when they are logged, as a value which cannot be converted to the
+        dtype would otherwise make every later conversion of the report to a DataFrame fail.
+        Nullable pandas dtypes (e.g. 'Int64') accept None.
+        """
+        name = getattr(dtype, '__name__', dtype)
+        nullable = pd.api.types.is_extension_array_dtype(dtype)
+        if pd.api.types.is_bool_dtype(dtype):
+            def is_valid(value):
+                return isinstance(value, (bool, np.bool_))
+            expected = 'True or False'
+        elif pd.api.types.is_integer_dtype(dtype):
+            def is_valid(value):
+                return isinstance(value, numbers.Integral) and not isinstance(value, bool)
+            expected = 'an integer'
+        elif pd.api.types.is_float_dtype(dtype):
+            # Missing values are read back as NaN
+            nullable = True
+
+            def is_valid(value):
+                return isinstance(value, numbers.Real) and not isinstance(value, bool)
+            expected = 'a number'
+        else:
+            return None
+
+        def check(value):
+            if not (is_valid(value) or (nullable and value is None)):
+                raise ValueError(f'value {value!r} must be {expected} for dtype {name}')
+
+        return check
+
+    def _compile_appender(self, data_set_name, columns, checks):
+        """ Create the function which validates and appends a row for a registered report """
+        writerow = self.memory_writer[data_set_name].writerow
+        row_counts = self.row_counts
+        number_of_columns = len(columns)
+
+        def append(*values):
+            if len(values) != number_of_columns:
+                raise ValueError(f'Report {data_set_name} expects {number_of_columns} columns '
+                                 f'{columns}, received {len(values)}')
+            for index, column, check in checks:
+                try:
+                    check(values[index])
+                except ValueError as error:
+                    raise ValueError(f'Report {data_set_name} column {column}: {error}')
+
+            writerow((self.simulation_name, self.simulation_run, self.env.now) + values)
+            row_counts[data_set_name] += 1
+
+        return append
+
+    def get_row_logger(self, data_set_name):
+        """ Return the compiled row appender for a registered report
+
+        Calling the appender with the column values in schema order logs a row, which is the
+        fastest way to log from tight loops.
+
+        Keyword parameters:
+        data_set_name           The name of a report registered with register_report
+        """
+        appender = self.appenders.get(data_set_name, None)
+        if appender is None:
+            raise ValueError(f'Report {data_set_name} has not been registered')
+
+        return appender
+
+    def log_row(self, data_set_name, *values):
+        """ Log a row of values, in schema order, to a registered report
+
+        Keyword parameters:
+        data_set_name           The name of a report registered with register_report
+        values                  The column values
+        """
+        self.get_row_logger(data_set_name)(*values)
+
+    def create_aggregated_reporting(self, data_set_name, bucket_width, aggregations):
+        """ Register a report which aggregates logged values into fixed width time buckets
+
+        Values logged with log_reporting are folded into the bucket for the current simulation
+        time and one row is written per bucket from the bucket in which the report is created,
+        with the bucket start time as the time column. Buckets in which nothing is logged are
+        written with zero counts. Completed buckets are written when a later value is logged,
+        when results are read and when flush_aggregates is called. The bucket in progress is
+        included in get_results but is not written, unless it starts at the current simulation
+        time and holds no values, so a run until 100 with buckets of width 10 gives ten rows.
+
+        Keyword parameters:
+        data_set_name           The name for the data set to be recorded
+        bucket_width            The simulation time covered by each bucket
+        aggregations            Dictionary of column name -> list of aggregations, from count,
+                                sum, mean, min, max and last. Each aggregation is reported in
+                                the column '<column name>_<aggregation>'.
+
+        Example:
+            dc.create_aggregated_reporting('hourly', 60, {'arrival': ['count'],
+                                                          'wait': ['mean', 'max']})
+            dc.log_reporting('hourly', {'arrival': 1})
+        """
+        CheckList.fail_if_this_key_in_the_dictionary(data_set_name, self.memory_file)
+        Check.is_greater_than_zero(bucket_width)
+        CheckList.is_a_dictionary(aggregations)
+        CheckList.fail_if_dict_empty(aggregations)
+
+        columns = {}
+        output_columns = []
+        for column, functions in aggregations.items():
+            functions = [functions] if isinstance(functions, str) else list(functions)
+            for function in functions:
+                CheckList.fail_if_not_in_set(function, self.AGGREGATIONS)
+                output_columns.append(f'{column}_{function}')
+            columns[column] = functions
+
+        self._create_report(data_set_name, output_columns)
+        self.aggregates[data_set_name] = {'bucket_width': bucket_width,
+                                          'columns': columns,
+                                          'bucket': int(self.env.now // bucket_width),
+                                          'state': {}}
+
+    def flush_aggregates(self, until=None):
+        """ Write the buckets of aggregated reports which end at or before a time
+
+        Buckets in which nothing was logged are written with zero counts, so each report has one
+        row for every completed bucket, including the buckets after the last value logged.
+
+        Keyword parameters:
+        until                   Simulation time up to which buckets are written (default: now)
+        """
+        until = self.env.now if until is None else until
+        for data_set_name, aggregate in self.aggregates.items():
+            self._advance_bucket(data_set_name, aggregate,
+                                 int(until // aggregate['bucket_width']))
+
+    def _advance_bucket(self, data_set_name, aggregate, bucket):
+        """ Write the current bucket and any empty buckets before a later bucket """
+        for completed in range(aggregate['bucket'], bucket):
+            self.memory_writer[data_set_name].writerow(self._bucket_row(aggregate, completed))
+            self.row_counts[data_set_name] += 1
+            aggregate['state'] = {}
+        if bucket > aggregate['bucket']:
+            aggregate['bucket'] = bucket
+
+    def _aggregate(self, data_set_name, aggregate, column_dictionary):
+        """ Fold the values logged into the current bucket of an aggregated report """
+        # Check every column before changing the report
+        for column in column_dictionary:
+            if column not in aggregate['columns']:
+                raise ValueError(f'Report {data_set_name} does not aggregate column {column}')
+
+        self._advance_bucket(data_set_name, aggregate,
+                             int(self.env.now // aggregate['bucket_width']))
+
+        state = aggregate['state']
+        for column, value in column_dictionary.items():
+            if value is None:
+                continue
+
+            # count, sum, min, max, last
+            values = state.get(column, None)
+            if values is None:
+                state[column] = [1, value, value, value, value]
+            else:
+                values[0] += 1
+                values[1] += value
+                values[2] = value if value < values[2] else values[2]
+                values[3] = value if value > values[3] else values[3]
+                values[4] = value
+
+    def _bucket_row(self, aggregate, bucket):
+        """ Return the row for a bucket of an aggregated report """
+        row = [self.simulation_name, self.simulation_run, bucket * aggregate['bucket_width']]
+        for column, functions in aggregate['columns'].items():
+            # Aggregates of empty buckets are NaN so the columns keep a numeric dtype
+            count, total, minimum, maximum, last = aggregate['state'].get(column, (0, 0, math.nan,
+                                                                                  math.nan,
+                                                                                  math.nan))
+            results = {'count': count,
+                       'sum': total,
+                       'mean': total / count if count else math.nan,
+                       'min': minimum,
+                       'max': maximum,
+                       'last': last}
+            row.extend(results[function] for function in functions)
+
+        return row
+
     def log_reporting(self, data_set_name, column_dictionary):
         """ Log data submitted by the simulation
 
+        Values logged to an aggregated report are folded into the current time bucket.
+
+        If the report has not been registered it is created with the columns of the first
+        dictionary logged. Columns missing from later dictionaries are recorded as Null and
+        additional columns raise a ValueError. The dictionary is not modified.
+
         Keyword parameters:
         data_set_name           The name of the dataset into which data stored
         column_dictionary       The method to call to fetch the data
          """
-
-        CheckList.is_a_dictionary(column_dictionary)
+        aggregate = self.aggregates.get(data_set_name, None)
+        if aggregate is not None:
+            self._aggregate(data_set_name, aggregate, column_dictionary)
+            return
+
+        appender = self.appenders.get(data_set_name, None)
+        if appender is not None:
+            columns = self.columns[data_set_name]
+            if column_dictionary.keys() != self.column_sets[data_set_name]:
+                raise ValueError(f'Report {data_set_name} expects columns {columns}, '
+                                 f'received {list(column_dictionary.keys())}')
+            appender(*[column_dictionary[column] for column in columns])
+            return
 
         # If the report doesn't already exist, create a new report
         if not (data_set_name in self.memory_file):
-            header_list = []
-            for key, _ in column_dictionary.items():
-                header_list.append(key)
+            CheckList.is_a_dictionary(column_dictionary)
+            self._create_report(data_set_name, list(column_dictionary.keys()))
 
-            header_list.insert(0, 'time')
-            header_list.insert(0, 'simulation_run')
-            header_list.insert(0, 'simulation_name')
+        columns = self.columns[data_set_name]
+        if not (column_dictionary.keys() <= self.column_sets[data_set_name]):
+            raise ValueError(f'Report {data_set_name} expects columns {columns}, '
+                             f'received {list(column_dictionary.keys())}')
 
-            # Create a new memory file into which data will be stored as CSV file
-            self.memory_file[data_set_name] = StringIO()
-            self.memory_writer[data_set_name] = DictWriter(self.memory_file[data_set_name],
-                                                           header_list,
-                                                           restval='Null',
-                                                           extrasaction='raise')
+        # Write data to memory file
+        self.memory_writer[data_set_name].writerow(
+            [self.simulation_name, self.simulation_run, self.env.now]
+            + [column_dictionary.get(column, 'Null') for column in columns])
+        self.row_counts[data_set_name] += 1
 
-            self.memory_writer[data_set_name].writeheader()
+    def _create_report(self, data_set_name, columns):
+        """ Create the in-memory csv file for a report
 
-        # Write data to memory file
-        column_dictionary['time'] = self.env.now
-        column_dictionary['simulation_run'] = self.simulation_run
-        column_dictionary['simulation_name'] = self.simulation_name
-        self.memory_writer[data_set_name].writerow(column_dictionary)
+        Keyword parameters:
+        data_set_name           The name for the data set to be recorded
+        columns                 List of the column names logged by the simulation
+        """
+        header_list = ['simulation_name', 'simulation_run', 'time'] + columns
+
+        # Create a new memory file into which data will be stored as CSV file
+        self.memory_file[data_set_name] = StringIO()
+        self.memory_writer[data_set_name] = writer(self.memory_file[data_set_name])
+        self.memory_writer[data_set_name].writerow(header_list)
+
+        self.columns[data_set_name] = columns
+        self.column_sets[data_set_name] = set(columns)
+        self.row_counts[data_set_name] = 0
 
     def counter_increment(self, data_set_name, amount=None):
         """Increment counter
@@ -179,21 +439,148 @@ class DataCollection:
 
         self.counters[data_set_name] -= amount
 
+    def _materialise(self, data_set_name):
+        """ Parse the rows written to a report since the last call
+
+        New rows are parsed into a chunk added to the chunks cached for the report. Chunks after
+        the first rows are parsed with the dtypes of those rows, or of the declared schema, so
+        values are read the same way whenever results are taken. If new rows cannot be read
+        with those dtypes, for example text in a column of integers, the whole report is parsed
+        again so the dtypes are inferred from all of the rows, as a single parse would.
+
+        Keyword parameters:
+        data_set_name           The name of the data set
+
+        Return: dictionary of the parsed chunks and the total number of rows after each chunk
+        """
+        # Write the buckets of an aggregated report completed by the current time
+        aggregate = self.aggregates.get(data_set_name, None)
+        if aggregate is not None:
+            self._advance_bucket(data_set_name, aggregate,
+                                 int(self.env.now // aggregate['bucket_width']))
+
+        file = self.memory_file[data_set_name]
+        cache = self.materialised.get(data_set_name, None)
+        end = file.seek(0, SEEK_END)
+        if cache is not None and end == cache['offset']:
+            return cache
+
+        declared = self.dtypes.get(data_set_name, None)
+        if cache is None:
+            file.seek(0)
+            chunk = pd.read_csv(file, dtype=declared)
+            cache = {'empty': chunk.iloc[0:0], 'dtypes': None, 'chunks': [], 'ends': [],
+                     'frame': None, 'offset': 0}
+            self.materialised[data_set_name] = cache
+        else:
+            file.seek(cache['offset'])
+            try:
+                chunk = pd.read_csv(file, header=None, names=list(cache['empty'].columns),
+                                    dtype=cache['dtypes'] if cache['dtypes'] else declared)
+            except (ValueError, TypeError):
+                file.seek(0)
+                chunk = pd.read_csv(file, dtype=declared)
+                cache.update(dtypes=None, chunks=[], ends=[])
+
+        if not chunk.empty:
+            if cache['dtypes'] is None:
+                cache['dtypes'] = dict(chunk.dtypes)
+            rows = cache['ends'][-1] if cache['ends'] else 0
+            cache['chunks'].append(chunk)
+            cache['ends'].append(rows + len(chunk))
+            cache['frame'] = None
+
+        # Writers append at the current position, so leave it at the end of the file
+        file.seek(0, SEEK_END)
+        cache['offset'] = end
+        return cache
+
+    @staticmethod
+    def _cached_frame(cache):
+        """ Return the DataFrame of all parsed chunks, concatenated only when rows were added """
+        if cache['frame'] is None:
+            chunks = cache['chunks']
+            if not chunks:
+                cache['frame'] = cache['empty']
+            else:
+                frame = chunks[0] if len(chunks) == 1 else pd.concat(chunks, ignore_index=True)
+                cache['frame'] = frame
+                cache['chunks'] = [frame]
+                cache['ends'] = [len(frame)]
+
+        return cache['frame']
+
     def get_results(self, data_set_name):
-        """ Return stored data as a pandas data frame """
-        file = self.memory_file.get(data_set_name, None)
+        """ Return stored data as a pandas data frame
+
+        The data frame shares its data with the frame cached for the report, so values must not
+        be modified in place.
+        """
         df = None
-        if file is not None:
-            file.seek(0)
-            df = pd.read_csv(file)
+        if data_set_name in self.memory_file:
+            df = self._cached_frame(self._materialise(data_set_name)).copy(deep=False)
+
+            # Include the bucket in progress for aggregated reports, unless it has just started
+            aggregate = self.aggregates.get(data_set_name, None)
+            if aggregate is not None and (aggregate['state'] or aggregate['bucket'] *
+                                          aggregate['bucket_width'] < self.env.now):
+                partial = pd.DataFrame([self._bucket_row(aggregate, aggregate['bucket'])],
+                                       columns=df.columns)
+                df = partial if df.empty else pd.concat([df, partial], ignore_index=True)
 
         return df
 
+    def get_results_since(self, data_set_name, marker=0):
+        """ Return the rows added to a report since a marker
+
+        Only the chunks parsed since the marker are combined, so the cost depends on the number
+        of new rows rather than the size of the report. For aggregated reports only completed
+        buckets are returned. If later rows change the dtype of a column (see _materialise) the
+        rows already returned are not revised.
+
+        Keyword parameters:
+        data_set_name           The name of the data set
+        marker                  Marker returned by the previous call, 0 for all rows
+
+        Return: (pandas data frame of the new rows, marker for the next call)
+        """
+        if data_set_name not in self.memory_file:
+            raise ValueError(f'Report {data_set_name} does not exist')
+
+        cache = self._materialise(data_set_name)
+        ends = cache['ends']
+        rows = ends[-1] if ends else 0
+
+        first = bisect_right(ends, marker)
+        if first == len(ends):
+            return cache['empty'].copy(deep=False), rows
+
+        start = ends[first - 1] if first else 0
+        chunks = [cache['chunks'][first].iloc[marker - start:]] + cache['chunks'][first + 1:]
+        delta = chunks[0] if len(chunks) == 1 else pd.concat(chunks, ignore_index=True)
+        return delta.reset_index(drop=True), rows
+
     def get_counter(self, data_set_name):
         """return value of a counter"""
 
         return self.counters.get(data_set_name, None)
 
+    def get_memory_usage(self):
+        """ Return the size of the in-memory buffer for each report
+
+        Buffer bytes are the length of the in-memory csv file, assuming one byte per character.
+        The length is taken from the end of file position so the buffer is not copied.
+
+        Return: pandas data frame with columns report, rows and buffer_bytes
+        """
+        usage = {'report': [], 'rows': [], 'buffer_bytes': []}
+        for key, file in self.memory_file.items():
+            usage['report'].append(key)
+            usage['rows'].append(self.row_counts[key])
+            usage['buffer_bytes'].append(file.seek(0, SEEK_END))
+
+        return pd.DataFrame(usage)
+
     def get_list_of_reports(self):
         """ Get a list of reports
 
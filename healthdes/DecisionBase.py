@@ -1,6 +1,5 @@
 """ HealthDES - A python library to support discrete event simulation in health and social care """
 
-import simpy
 from .Routing import Activity_ID
 
 
@@ -12,7 +11,7 @@ class DecisionBase:
 
     def get_next_activity(self, person, activity_a):
         """ Dummy method to anchor class """
-        return Activity_ID(None, None, None)
+        return Activity_ID(None, None, None, None)
 
 
 class NextActivity(DecisionBase):
@@ -23,13 +22,4 @@ class NextActivity(DecisionBase):
     def get_next_activity(self, person, activity_a):
 
         # TODO: Need to sort routing access
-        activity = person.routing.get_activity(activity_a.routing_id)
-
-        # Add this instance to the arguments list
-        activity.kwargs['person'] = self
-
-        # Create two communication pipes for bi-directional communication with activity
-        activity.kwargs['message_to_activity'] = simpy.Store(self.env)
-        activity.kwargs['message_to_person'] = simpy.Store(self.env)
-
-        return activity
+        return person.get_activity(activity_a.activity.next_activity_id)
@@ -0,0 +1,399 @@
+""" HealthDES - A python library to support discrete event simulation in health and social care """
+
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import socket
+import stat
+
+from concurrent.futures import ProcessPoolExecutor
+
+# Import local libraries
+# pylint: disable=relative-beyond-top-level
+from .SimulationCounts import SimulationCounts
+
+
+class JobCancelled(Exception):
+    """ Raised inside a running simulation when its job has been cancelled """
+
+
+class ProgressReporter:
+    """ Class passed to a job function to report progress from the worker process
+
+    Attach the reporter to the simulation to send progress periodically: the simulated time
+    reached, the number of people who have completed, the data collection counters and the
+    current rows of any aggregated reports (see DataCollection.create_aggregated_reporting). If
+    the job is cancelled the next progress report raises JobCancelled, stopping the simulation.
+    """
+
+    def __init__(self, job_id, updates, cancel_event):
+        """Create a progress reporter
+
+        Arguments:
+            job_id {int} -- ID of the job
+            updates {Queue} -- Manager queue to which progress is sent
+            cancel_event {Event} -- Manager event set when the job is cancelled
+        """
+        self.job_id = job_id
+        self.updates = updates
+        self.cancel_event = cancel_event
+
+    @property
+    def cancelled(self):
+        """True if the job has been cancelled"""
+        return self.cancel_event.is_set()
+
+    def report(self, **progress):
+        """Send progress to the job service
+
+        Raises:
+            JobCancelled: The job has been cancelled
+        """
+        if self.cancelled:
+            raise JobCancelled(f'Job {self.job_id} cancelled')
+
+        progress['job_id'] = self.job_id
+        self.updates.put(progress)
+
+    def attach(self, simulation_params, interval):
+        """Report progress periodically while the simulation runs
+
+        Arguments:
+            simulation_params {dictionary} -- keyword arguments for the simulation
+            interval {float} -- Simulated time between progress reports
+        """
+        env = simulation_params.get('simpy_env', None)
+        dc = simulation_params.get('data_collector', None)
+        env.process(self.periodic_progress(env, dc, interval))
+
+    def periodic_progress(self, env, dc, interval):
+        """ Process to report progress from the simulation """
+        counts = SimulationCounts.for_env(env)
+        while True:
+            progress = {'time': env.now,
+                        'persons_completed': counts.persons_completed}
+            if dc is not None:
+                progress['counters'] = dict(dc.counters)
+                progress['aggregates'] = {name: dc.get_results(name).to_dict('records')
+                                          for name in dc.aggregates}
+            self.report(**progress)
+
+            yield env.timeout(interval)
+
+
+def _run_job(function, params, reporter):
+    """Run a job function in a worker process"""
+    return function(params, reporter)
+
+
+class SimulationJob:
+    """ A simulation job submitted to the SimulationJobService
+
+    Iterate over progress() to receive progress reports as they arrive, await result() for the
+    value returned by the job function and call cancel() to stop the job.
+    """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    CANCELLED = 'cancelled'
+    FAILED = 'failed'
+
+    def __init__(self, job_id, function, params, priority, cancel_event):
+        self.job_id = job_id
+        self.function = function
+        self.params = params
+        self.priority = priority
+        self.status = SimulationJob.QUEUED
+        self.cancel_event = cancel_event
+        # (status, result, exception) once the job function has returned
+        self.outcome = None
+
+        self.updates = asyncio.Queue()
+        self.future = asyncio.get_running_loop().create_future()
+
+    async def progress(self):
+        """Asynchronous iterator over progress reports, ends when the job finishes"""
+        while True:
+            progress = await self.updates.get()
+            if progress is None:
+                return
+            yield progress
+
+    async def result(self):
+        """Wait for the job to finish and return the value returned by the job function
+
+        Raises:
+            JobCancelled: The job was cancelled
+        """
+        return await asyncio.shield(self.future)
+
+    def cancel(self):
+        """Cancel the job, a running job stops at its next progress report"""
+        if self.status == SimulationJob.QUEUED:
+            self._finish(SimulationJob.CANCELLED, None,
+                         JobCancelled(f'Job {self.job_id} cancelled'))
+        self.cancel_event.set()
+
+    def _finish(self, status, result, exception):
+        """Record the outcome of the job and end the progress stream"""
+        if self.future.done():
+            return
+        self.status = status
+        if exception is not None:
+            self.future.set_exception(exception)
+            # The exception is reported through result(), avoid warnings if nobody awaits it
+            self.future.exception()
+        else:
+            self.future.set_result(result)
+        self.updates.put_nowait(None)
+
+
+class SimulationJobService:
+    """ Class to run simulation jobs on a local process pool from asyncio
+
+    Jobs are functions function(params, reporter) defined at module level, where reporter is a
+    ProgressReporter. Jobs are started in priority order (highest priority first, then in order
+    of submission) with at most max_workers running at once. The service keeps a job only until
+    it finishes; the caller holds the SimulationJob for its result.
+
+    Example:
+        async with SimulationJobService(max_workers=4) as service:
+            job = service.submit(run_scenario, {'beds': 20}, priority=1)
+            async for progress in job.progress():
+                print(progress['time'])
+            results = await job.result()
+    """
+
+    def __init__(self, max_workers=None):
+        """Create the job service
+
+        Keyword Arguments:
+            max_workers {int} -- Number of worker processes (default: {number of processors})
+        """
+        self.max_workers = max_workers if max_workers else multiprocessing.cpu_count()
+        self.jobs = {}
+        self.job_ids = itertools.count()
+        self.submitted = itertools.count()
+
+        self.executor = None
+        self.manager = None
+        self.updates = None
+        self.queue = None
+        self.tasks = []
+        self.progress_task = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def start(self):
+        """Start the process pool and the tasks which dispatch jobs and progress"""
+        loop = asyncio.get_running_loop()
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        self.manager = multiprocessing.Manager()
+        self.updates = self.manager.Queue()
+        self.queue = asyncio.PriorityQueue()
+
+        self.tasks = [loop.create_task(self._dispatch()) for _ in range(self.max_workers)]
+        self.progress_task = loop.run_in_executor(None, self._forward_progress, loop)
+
+    async def stop(self):
+        """Cancel queued and running jobs and shut down the process pool
+
+        Running jobs stop at their next progress report, the pool is shut down in a thread so the
+        event loop is not blocked while they finish.
+        """
+        loop = asyncio.get_running_loop()
+        for job in list(self.jobs.values()):
+            job.cancel()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+        await loop.run_in_executor(None, self.executor.shutdown)
+        self.updates.put(None)
+        await self.progress_task
+        await loop.run_in_executor(None, self.manager.shutdown)
+
+    def submit(self, function, params, priority=0):
+        """Submit a job
+
+        Arguments:
+            function {function} -- Module level function called as function(params, reporter)
+            params {obj} -- Picklable parameters for the job
+
+        Keyword Arguments:
+            priority {int} -- Jobs with higher priority start first (default: {0})
+
+        Returns:
+            SimulationJob -- The job
+        """
+        job = SimulationJob(next(self.job_ids), function, params, priority,
+                            self.manager.Event())
+        self.jobs[job.job_id] = job
+        # Forget the job once its outcome is delivered, the caller holds the job for its result
+        job.future.add_done_callback(lambda _: self.jobs.pop(job.job_id, None))
+        self.queue.put_nowait((-priority, next(self.submitted), job))
+        return job
+
+    def cancel(self, job_id):
+        """Cancel a job by ID, jobs which have already finished are ignored
+
+        Arguments:
+            job_id {int} -- ID of the job
+        """
+        job = self.jobs.get(job_id, None)
+        if job is not None:
+            job.cancel()
+
+    async def _dispatch(self):
+        """Run queued jobs in the process pool, one at a time"""
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, job = await self.queue.get()
+            if job.status != SimulationJob.QUEUED:
+                continue
+
+            job.status = SimulationJob.RUNNING
+            reporter = ProgressReporter(job.job_id, self.updates, job.cancel_event)
+            try:
+                result = await loop.run_in_executor(self.executor, _run_job, job.function,
+                                                    job.params, reporter)
+            except JobCancelled as error:
+                job.outcome = (SimulationJob.CANCELLED, None, error)
+            except asyncio.CancelledError:
+                job._finish(SimulationJob.CANCELLED, None,
+                            JobCancelled(f'Job {job.job_id} cancelled'))
+                raise
+            except Exception as error:
+                job.outcome = (SimulationJob.FAILED, None, error)
+            else:
+                job.outcome = (SimulationJob.COMPLETED, result, None)
+
+            # Finish the job through the progress queue, after the progress it has sent
+            await loop.run_in_executor(None, self.updates.put,
+                                       {'job_id': job.job_id, 'finished': True})
+
+    def _forward_progress(self, loop):
+        """Thread which forwards progress from the worker processes to each job's stream"""
+        while True:
+            progress = self.updates.get()
+            if progress is None:
+                return
+            job = self.jobs.get(progress['job_id'], None)
+            if job is not None:
+                loop.call_soon_threadsafe(self._put_progress, job, progress)
+
+    @staticmethod
+    def _put_progress(job, progress):
+        """Add progress to a job's stream, or finish the job once all its progress is sent"""
+        if progress.get('finished', False):
+            job._finish(*job.outcome)
+        elif not job.future.done():
+            job.updates.put_nowait(progress)
+
+
+async def serve_jobs(service, jobs, host='127.0.0.1', port=0, path=None, mode=0o600):
+    """Serve a job service over a localhost TCP socket or a Unix socket
+
+    Clients can only run the jobs registered in the jobs dictionary, by name. The Unix socket is
+    created with the permissions in mode, so by default only the user running the server can
+    connect. The TCP socket has no access control, any local user can connect to it.
+
+    The protocol is JSON lines. A client sends one request per connection:
+
+        {"submit": "job name", "params": {...}, "priority": 0}
+            The server replies {"event": "submitted", "job_id": ...}, then one line
+            {"event": "progress", ...} for each progress report and finally
+            {"event": "completed", "result": ...}, {"event": "cancelled"} or
+            {"event": "failed", "error": ...}. Results which are not JSON serialisable are
+            returned as strings.
+        {"cancel": job_id}
+            The server replies {"event": "cancelling", "job_id": ...}.
+
+    Requests which cannot be read, or which name a job that is not registered, receive
+    {"event": "error", "error": ...}.
+
+    Arguments:
+        service {SimulationJobService} -- A started job service
+        jobs {dictionary} -- Job name -> module level function called as function(params, reporter)
+
+    Keyword Arguments:
+        host {str} -- Host for the TCP socket (default: {'127.0.0.1'})
+        port {int} -- Port for the TCP socket, 0 picks a free port (default: {0})
+        path {str} -- Path of a Unix socket, used instead of TCP if given (default: {None})
+        mode {int} -- Permissions of the Unix socket (default: {0o600})
+
+    Returns:
+        asyncio.Server -- The server, close() it to stop serving
+    """
+    jobs = dict(jobs)
+
+    async def send(writer, message):
+        writer.write(json.dumps(message, default=str).encode('utf-8') + b'\n')
+        await writer.drain()
+
+    async def handle(reader, writer):
+        try:
+            try:
+                request = json.loads(await reader.readline())
+                if not isinstance(request, dict):
+                    raise ValueError('Request must be a JSON object')
+            except ValueError as error:
+                await send(writer, {'event': 'error', 'error': f'Invalid request: {error}'})
+                return
+
+            if 'cancel' in request:
+                job_id = request['cancel']
+                if isinstance(job_id, bool) or not isinstance(job_id, int):
+                    await send(writer, {'event': 'error', 'error': 'job_id must be an integer'})
+                    return
+                service.cancel(job_id)
+                await send(writer, {'event': 'cancelling', 'job_id': job_id})
+                return
+
+            name = request.get('submit', None)
+            function = jobs.get(name, None) if isinstance(name, str) else None
+            priority = request.get('priority', 0)
+            if function is None:
+                await send(writer, {'event': 'error', 'error': f'Unknown job {name!r}'})
+                return
+            if isinstance(priority, bool) or not isinstance(priority, int):
+                await send(writer, {'event': 'error', 'error': 'priority must be an integer'})
+                return
+
+            job = service.submit(function, request.get('params', None), priority)
+            await send(writer, {'event': 'submitted', 'job_id': job.job_id})
+            async for progress in job.progress():
+                await send(writer, dict(progress, event='progress'))
+            try:
+                await send(writer, {'event': 'completed', 'result': await job.result()})
+            except JobCancelled:
+                await send(writer, {'event': 'cancelled', 'job_id': job.job_id})
+            except Exception as error:
+                await send(writer, {'event': 'failed', 'error': repr(error)})
+        finally:
+            writer.close()
+
+    if path is not None:
+        # As asyncio, replace the socket file left by an earlier server
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.remove(path)
+
+        # Bind the socket and apply the mode before listening, no client can connect until the
+        # server starts listening
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.bind(path)
+            os.chmod(path, mode)
+        except OSError:
+            sock.close()
+            raise
+        return await asyncio.start_unix_server(handle, sock=sock)
+    return await asyncio.start_server(handle, host=host, port=port)
@@ -0,0 +1,135 @@
+""" HealthDES - A python library to support discrete event simulation in health and social care """
+
+import pandas as pd
+
+
+class JourneyRecord:
+    """ Journey of a single person through the system, maintained while the person runs
+
+    Each activity visited is held as a list [activity_name, seize_requested, resources_seized,
+    started, completed] of simulation times. A person only ever waits on the most recently
+    requested activity, so every message after the seize request updates the last entry.
+    """
+    __slots__ = ['pid', 'entry_time', 'activities']
+
+    def __init__(self, pid, entry_time):
+        self.pid = pid
+        self.entry_time = entry_time
+        self.activities = []
+
+    def message(self, message, activity_name, time):
+        """Update the journey with a message passed between the person and an activity
+
+        Arguments:
+            message {str} -- Message sent to, or received from, the activity
+            activity_name {str} -- Name of the activity
+            time {float} -- Simulation time of the message
+        """
+        if message == 'seize_resources':
+            self.activities.append([activity_name, time, None, None, None])
+        elif message == 'resources_seized':
+            self.activities[-1][2] = time
+        elif message == 'start':
+            self.activities[-1][3] = time
+        elif message == 'completed':
+            self.activities[-1][4] = time
+
+
+class JourneyRecorder:
+    """ Class to build the patient journey tables incrementally as people move through the system
+
+    Journey recording is opt-in: add the recorder to the simulation parameters under the key
+    'journey_recorder' and PersonBase will maintain a JourneyRecord as it moves between
+    activities. When the person reaches the end state the record is finalised into two columnar
+    tables:
+
+    journeys            One row per person: entry and exit time, length of stay, number of
+                        activities, path taken and total seize-wait and service time.
+    journey_activities  One row per activity visited: seize request, resources seized, start and
+                        completion times, seize-wait and service time.
+    """
+
+    JOURNEY_COLUMNS = ['simulation_name', 'simulation_run', 'pid', 'entry_time', 'exit_time',
+                       'length_of_stay', 'activities', 'path', 'total_wait', 'total_service']
+
+    ACTIVITY_COLUMNS = ['simulation_name', 'simulation_run', 'pid', 'sequence', 'activity',
+                        'seize_requested', 'resources_seized', 'started', 'completed', 'wait',
+                        'service']
+
+    def __init__(self, simulation_name=None, simulation_run=None, path_separator='>'):
+        """Create a journey recorder
+
+        Keyword Arguments:
+            simulation_name {str} -- The name for this simulation (default: {None})
+            simulation_run {int} -- The sequence number for this run (default: {None})
+            path_separator {str} -- Separator between activities in the path (default: {'>'})
+        """
+        self.simulation_name = simulation_name
+        self.simulation_run = simulation_run
+        self.path_separator = path_separator
+
+        self.journeys = {column: [] for column in self.JOURNEY_COLUMNS}
+        self.journey_activities = {column: [] for column in self.ACTIVITY_COLUMNS}
+
+    def start(self, pid, time):
+        """Start recording the journey for a person
+
+        Arguments:
+            pid {int} -- Person ID
+            time {float} -- Simulation time the person entered the system
+
+        Returns:
+            JourneyRecord -- The journey record to be updated as the person moves
+        """
+        return JourneyRecord(pid, time)
+
+    def finish(self, record, time):
+        """Finalise a journey record into the journey tables
+
+        Arguments:
+            record {JourneyRecord} -- The journey record for the person
+            time {float} -- Simulation time the person left the system
+        """
+        journeys = self.journeys
+        activities = self.journey_activities
+
+        total_wait = 0
+        total_service = 0
+        for sequence, (name, requested, seized, started, completed) in \
+                enumerate(record.activities):
+            wait = seized - requested if seized is not None else None
+            service = completed - started if completed is not None else None
+            total_wait += wait if wait is not None else 0
+            total_service += service if service is not None else 0
+
+            activities['simulation_name'].append(self.simulation_name)
+            activities['simulation_run'].append(self.simulation_run)
+            activities['pid'].append(record.pid)
+            activities['sequence'].append(sequence)
+            activities['activity'].append(name)
+            activities['seize_requested'].append(requested)
+            activities['resources_seized'].append(seized)
+            activities['started'].append(started)
+            activities['completed'].append(completed)
+            activities['wait'].append(wait)
+            activities['service'].append(service)
+
+        journeys['simulation_name'].append(self.simulation_name)
+        journeys['simulation_run'].append(self.simulation_run)
+        journeys['pid'].append(record.pid)
+        journeys['entry_time'].append(record.entry_time)
+        journeys['exit_time'].append(time)
+        journeys['length_of_stay'].append(time - record.entry_time)
+        journeys['activities'].append(len(record.activities))
+        journeys['path'].append(self.path_separator.join(str(activity[0])
+                                                         for activity in record.activities))
+        journeys['total_wait'].append(total_wait)
+        journeys['total_service'].append(total_service)
+
+    def get_journeys(self):
+        """ Return the completed journeys as a pandas data frame """
+        return pd.DataFrame(self.journeys, columns=self.JOURNEY_COLUMNS)
+
+    def get_journey_activities(self):
+        """ Return the activities of completed journeys as a pandas data frame """
+        return pd.DataFrame(self.journey_activities, columns=self.ACTIVITY_COLUMNS)
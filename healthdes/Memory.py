@@ -0,0 +1,109 @@
+""" HealthDES - A python library to support discrete event simulation in health and social care """
+
+import tracemalloc
+
+# Import local libraries
+# pylint: disable=relative-beyond-top-level
+from .ActivityContext import ActivityContextPool
+from .SimulationCounts import SimulationCounts
+
+
+class MemoryMonitor:
+    """ Class to report the memory footprint of a simulation
+
+    The monitor periodically records the number of people and activities running, the number of
+    open and pooled communication pipes, the length of the simpy event queue and the rows and
+    buffer size of each data collection report. Optionally, tracemalloc snapshots of the largest
+    allocations are taken at a separate interval. Results are logged to the data collector as the
+    reports 'memory_usage' and 'memory_allocations' so they are returned alongside the simulation
+    results.
+
+    Counts of people and activities are kept for the simulation's simpy environment (see
+    SimulationCounts). An activity count that keeps growing while people complete indicates
+    activities that never reach the ended state.
+    """
+
+    def __init__(self, simulation_params, interval, tracemalloc_interval=None, top=10):
+        """Create a memory monitor
+
+        Arguments:
+            simulation_params {dictionary} -- keyword arguments for the simulation
+            interval {float} -- Simulated time between memory usage reports
+
+        Keyword Arguments:
+            tracemalloc_interval {float} -- Simulated time between tracemalloc snapshots, if None
+                                            tracemalloc is not used (default: {None})
+            top {int} -- Number of allocation sites reported in each snapshot (default: {10})
+        """
+        self.env = simulation_params.get('simpy_env', None)
+        self.dc = simulation_params.get('data_collector', None)
+        self.interval = interval
+        self.tracemalloc_interval = tracemalloc_interval
+        self.top = top
+
+    def start(self):
+        """Start the periodic memory reporting processes"""
+        self.env.process(self.periodic_usage())
+
+        if self.tracemalloc_interval is not None:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self.env.process(self.periodic_allocations())
+
+    def get_usage(self):
+        """Return the current memory usage of the simulation
+
+        Returns:
+            dictionary -- Counts of people, activities, pipes, events and data collection size
+        """
+        context_pool = ActivityContextPool.for_env(self.env)
+        counts = SimulationCounts.for_env(self.env)
+        usage = {
+            'persons_active': counts.persons_active,
+            'persons_completed': counts.persons_completed,
+            'activities_active': counts.activities_active,
+            # Each activity context holds two simpy.Store pipes between person and activity
+            'open_pipes': 2 * context_pool.in_use,
+            'pooled_pipes': 2 * len(context_pool.free),
+            'event_queue': len(getattr(self.env, '_queue', ())),
+            'report_rows': 0,
+            'report_buffer_bytes': 0
+        }
+
+        if self.dc is not None:
+            report_usage = self.dc.get_memory_usage()
+            usage['report_rows'] = int(report_usage['rows'].sum())
+            usage['report_buffer_bytes'] = int(report_usage['buffer_bytes'].sum())
+
+        return usage
+
+    def get_allocations(self):
+        """Take a tracemalloc snapshot and return the largest allocation sites
+
+        Returns:
+            list -- dictionaries of rank, location, size_bytes and blocks
+        """
+        statistics = tracemalloc.take_snapshot().statistics('lineno')[:self.top]
+
+        allocations = []
+        for rank, statistic in enumerate(statistics):
+            allocations.append({'rank': rank,
+                                'location': str(statistic.traceback),
+                                'size_bytes': statistic.size,
+                                'blocks': statistic.count})
+        return allocations
+
+    def periodic_usage(self):
+        """ Process to log memory usage to the data collector """
+        while True:
+            self.dc.log_reporting('memory_usage', self.get_usage())
+
+            yield self.env.timeout(self.interval)
+
+    def periodic_allocations(self):
+        """ Process to log tracemalloc snapshots to the data collector """
+        while True:
+            for allocation in self.get_allocations():
+                self.dc.log_reporting('memory_allocations', allocation)
+
+            yield self.env.timeout(self.tracemalloc_interval)
@@ -0,0 +1,127 @@
+""" HealthDES - A python library to support discrete event simulation in health and social care """
+
+import simpy
+
+from concurrent.futures import ProcessPoolExecutor
+
+# Import local libraries
+# pylint: disable=relative-beyond-top-level
+from .DataCollection import DataCollection
+from .PersonBase import PersonBase
+from .ResultTransport import export_results, gather_results
+from .Routing import END_NODE
+from .RoutingBundle import CompiledRouting, export_bundle
+
+
+def find_partitions(routing):
+    """Split a routing graph into partitions that can be simulated independently
+
+    Two decision nodes are in the same partition if they are connected by an activity, or if
+    activities attached to them use the same resource (see Routing.get_activity_resources).
+    Only resources named in the registered 'resource' and 'resources' arguments are seen.
+    Partitions which share a resource are merged, which is the conservative way to keep the
+    simulation of each partition exact. The 'end' node holds no state so it does not join
+    partitions; it is included in every partition with an activity leading to it.
+
+    Args:
+        routing (Routing): The routing graph
+
+    Returns:
+        list: A list of sets of decision nodes, largest partition first
+    """
+    parent = {node_id: node_id for node_id in routing.G.nodes}
+
+    def find(node_id):
+        while parent[node_id] != node_id:
+            parent[node_id] = parent[parent[node_id]]
+            node_id = parent[node_id]
+        return node_id
+
+    def union(a, b):
+        parent[find(a)] = find(b)
+
+    resource_owner = {}
+    for u, v, activity_name in routing.G.edges(keys=True):
+        if v != END_NODE:
+            union(u, v)
+        for resource in routing.get_activity_resources(activity_name):
+            if resource in resource_owner:
+                union(u, resource_owner[resource])
+            else:
+                resource_owner[resource] = u
+
+    partitions = {}
+    for node_id in routing.G.nodes:
+        if node_id != END_NODE:
+            partitions.setdefault(find(node_id), set()).add(node_id)
+
+    for u, v in routing.G.edges():
+        if v == END_NODE:
+            partitions[find(u)].add(END_NODE)
+
+    return sorted(partitions.values(), key=len, reverse=True)
+
+
+def run_partitioned(build_model, routing, until, simulation_name=None, simulation_run=None,
+                    processes=None):
+    """Run each independent partition of a model in its own process and merge the results
+
+    Every resource an activity uses must be named in its registered 'resource' or 'resources'
+    arguments. Partitions are found from those arguments alone (see find_partitions); an activity
+    which reaches a resource any other way, for example through simulation_params or a
+    decision, is not seen to share it, so the partitions are not independent and the merged
+    results are wrong.
+
+    Each partition is run in a separate simpy environment with its own DataCollection and a
+    compiled routing restricted to the partition, so activity arguments must be JSON serialisable
+    (name resources rather than passing resource objects, see export_bundle). In each worker
+    build_model(simulation_params, nodes) is called to create the resources and the processes
+    generating people for the decision nodes of that partition; it must be a module level
+    function so it can be sent to the worker processes.
+
+    Person IDs are interleaved between partitions so they remain unique in the merged results.
+
+    Args:
+        build_model (function): Function called with the simulation parameters and the set of
+                                decision nodes in the partition
+        routing (Routing): The routing graph for the whole model
+        until (float): Simulation time at which to stop each partition
+        simulation_name (str): The name for this simulation (default: None)
+        simulation_run (int): The sequence number for this run of the simulation (default: None)
+        processes (int): Maximum number of worker processes (default: number of processors)
+
+    Returns:
+        (dict, dict): Report name -> merged DataFrame, counter name -> total over partitions
+    """
+    partitions = find_partitions(routing)
+    tasks = [(build_model, export_bundle(routing.get_subrouting(nodes)), nodes, until,
+              simulation_name, simulation_run, index, len(partitions))
+             for index, nodes in enumerate(partitions)]
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        manifests = list(executor.map(_run_partition, tasks))
+
+    counters = {}
+    for manifest in manifests:
+        for counter, value in manifest['counters'].items():
+            counters[counter] = counters.get(counter, 0) + value
+
+    return gather_results(manifests), counters
+
+
+def _run_partition(task):
+    """Run one partition of a model in a worker process"""
+    (build_model, bundle, nodes, until, simulation_name, simulation_run, index,
+     number_of_partitions) = task
+
+    env = simpy.Environment()
+    simulation_params = {'simpy_env': env,
+                         'data_collector': DataCollection(env, simulation_name, simulation_run),
+                         'routing': CompiledRouting.from_bytes(bundle)}
+
+    # Interleave the person IDs of the partitions so they are unique across partitions
+    with PersonBase.person_ids(index, number_of_partitions):
+        build_model(simulation_params, nodes)
+        env.run(until=until)
+
+    return export_results(simulation_params['data_collector'])
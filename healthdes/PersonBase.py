@@ -1,10 +1,17 @@
 """ HealthDES - A python library to support discrete event simulation in health and social care """
 
-import simpy
 import itertools
 import yaml
 import sys
 
+from contextlib import contextmanager
+
+# Import local libraries
+# pylint: disable=relative-beyond-top-level
+from .ActivityContext import ActivityContextPool
+from .SimulationCounts import SimulationCounts
+from .Trace import SOURCE_PERSON
+
 
 class PersonBase:
     """ Class to implement a person as a simpy discreate event simulation
@@ -80,6 +87,10 @@ class PersonBase:
         self.dc = simulation_params.get('data_collector', None)
         self.routing = simulation_params.get('routing', None)
         self.time_interval = simulation_params.get('time_interval', None)
+        self.tracer = simulation_params.get('trace_recorder', None)
+        self.journeys = simulation_params.get('journey_recorder', None)
+        self.context_pool = ActivityContextPool.for_env(self.env)
+        self.counts = SimulationCounts.for_env(self.env)
 
         # keep a record of person IDs
         self.PID = next(PersonBase.get_new_id)
@@ -93,6 +104,25 @@ class PersonBase:
         # Initialise do and attribute lists
         self._initialise_do_actions_and_attributes = {}
 
+    @staticmethod
+    @contextmanager
+    def person_ids(start=0, step=1):
+        """Number the people created within the context from start, in steps of step
+
+        The person ID counter is restored on leaving the context, so people created afterwards
+        are numbered as if the context had not been entered.
+
+        Keyword Arguments:
+            start {int} -- ID of the first person created (default: {0})
+            step {int} -- Difference between the IDs of consecutive people (default: {1})
+        """
+        saved = PersonBase.get_new_id
+        PersonBase.get_new_id = itertools.count(start, step)
+        try:
+            yield
+        finally:
+            PersonBase.get_new_id = saved
+
     def get_PID(self):
         """Return the Person ID (PID)
 
@@ -160,9 +190,15 @@ class PersonBase:
         activity_a = self.get_activity(self.starting_node_id)
         activity_b = None
 
+        journey = None
+        if self.journeys is not None:
+            journey = self.journeys.start(self.PID, self.env.now)
+
         # TODO: Add a periodic timeout (optional)
         #       periodic loop - inner state machine - end sm loop - yield - end periodic loop
 
+        self.counts.persons_active += 1
+
         # For each microenvironment that the person visits
         finished = False
         while not finished:
@@ -174,6 +210,11 @@ class PersonBase:
             if actions == 'NoMessage':
                 raise ValueError(f'Person received message error:s->{state}:m->{received_message}')
 
+            if self.tracer is not None:
+                self.tracer.record(self.env.now, self.PID, SOURCE_PERSON,
+                                   activity_a.activity.activity_name if activity_a else None,
+                                   state, received_message)
+
             action = actions.get('action', 'NOP')
             message_to_a = actions.get('message_to_a', 'NOP')
             message_to_b = actions.get('message_to_b', 'NOP')
@@ -188,31 +229,51 @@ class PersonBase:
 
             # execute activities
             if message_to_a != 'NOP':
-                activity_a.kwargs['message_to_activity'].put(message_to_a)
-                received_message = yield activity_a.kwargs['message_to_person'].get()
+                if journey is not None:
+                    journey.message(message_to_a, activity_a.activity.activity_name, self.env.now)
+                activity_a.message_to_activity.put(message_to_a)
+                received_message = yield activity_a.message_to_person.get()
+                if journey is not None:
+                    journey.message(received_message, activity_a.activity.activity_name,
+                                    self.env.now)
+                if received_message == 'ended':
+                    self.context_pool.release(activity_a)
                 received_message += '_a'
 
             elif message_to_b != 'NOP':
-                activity_b.kwargs['message_to_activity'].put(message_to_b)
-                received_message = yield activity_b.kwargs['message_to_person'].get()
+                if journey is not None:
+                    journey.message(message_to_b, activity_b.activity.activity_name, self.env.now)
+                activity_b.message_to_activity.put(message_to_b)
+                received_message = yield activity_b.message_to_person.get()
+                if journey is not None:
+                    journey.message(received_message, activity_b.activity.activity_name,
+                                    self.env.now)
+                if received_message == 'ended':
+                    self.context_pool.release(activity_b)
                 received_message += '_b'
 
             finished = True if state == 'end' else finished
 
+        if journey is not None:
+            self.journeys.finish(journey, self.env.now)
+
+        self.counts.persons_active -= 1
+        self.counts.persons_completed += 1
+
     def nop(self, a, b, received_message):
         """Function which does nothing
         """
         return (a, b, received_message)
 
     def get_next_node(self, a, b, received_message):
-        if a.next_activity_id == 'end':
+        if a.activity.next_activity_id == 'end':
             b = None
             received_message = 'branch_to_end'
 
         else:
             # If function call function else is type activity b (make sure activity)
             #  with self (person) and last activity (activity a) -> activity b
-            b = self.get_activity(a.next_activity_id)
+            b = self.get_activity(a.activity.next_activity_id)
             received_message = 'initialise_b'
 
         return (a, b, received_message)
@@ -232,19 +293,18 @@ class PersonBase:
         received_message = 'resources_seized_a'
         return (a, b, received_message)
 
-    def run_activity(self, activity):
-        activity_class = activity.activity_class(self.simulation_params, **activity.kwargs)
+    def run_activity(self, context):
+        activity = context.activity
+        activity_class = activity.activity_class(self.simulation_params, context, **activity.kwargs)
         self.env.process(activity_class.run())
 
     # TODO: Move this to default decisions
     def get_activity(self, routing_id):
-        activity = self.routing.get_activity(routing_id)
-
-        # Add this instance to the arguments list
-        activity.kwargs['person'] = self
+        """Return the context for this person to perform the next activity
 
-        # Create two communication pipes for bi-directional communication with activity
-        activity.kwargs['message_to_activity'] = simpy.Store(self.env)
-        activity.kwargs['message_to_person'] = simpy.Store(self.env)
+        The context holds the shared Activity_ID from the routing, this person and the two
+        communication pipes with the activity. It is returned to the pool when the activity ends.
+        """
+        activity = self.routing.get_activity(routing_id)
 
-        return activity
+        return self.context_pool.acquire(self, activity)
@@ -0,0 +1,195 @@
+""" HealthDES - A python library to support discrete event simulation in health and social care """
+
+import math
+import numbers
+
+import numpy as np
+import pandas as pd
+
+
+class QueueingNetwork:
+    """ Class to estimate activity performance analytically, treating the routing as a queueing
+    network
+
+    Each activity in the routing graph is treated as a service station with a number of servers.
+    People arrive at decision nodes at the given rates and take each activity leaving a node with
+    the routing probability of the edge (see Routing.get_routing_probabilities). The traffic
+    equations are solved for the arrival rate at each activity and each activity is then
+    approximated as an M/M/c queue or, when the squared coefficients of variation of arrivals or
+    service are given, a G/G/c queue using the Allen-Cunneen approximation.
+
+    These are open Jackson network estimates intended to screen scenarios quickly. They ignore
+    people holding a resource while waiting for the next activity, which the simulation models.
+
+    Service parameters for an activity are read from the service_params dictionary, falling back
+    to the arguments registered for the activity:
+        mean_service_time   Mean time to complete the activity (required)
+        servers             Number of servers, None for unlimited capacity (default: None)
+        service_scv         Squared coefficient of variation of service time (default: 1)
+        arrival_scv         Squared coefficient of variation of inter-arrival time (default: 1)
+    """
+
+    PARAMETER_DEFAULTS = {'mean_service_time': None,
+                          'servers': None,
+                          'service_scv': 1.0,
+                          'arrival_scv': 1.0}
+
+    def __init__(self, routing):
+        """Build the routing matrix for the network
+
+        The routing matrix depends only on the graph, so one instance can be solved for many
+        arrival rates and service parameters.
+
+        Arguments:
+            routing {Routing} -- The routing graph for the system
+        """
+        self.routing = routing
+
+        probabilities = routing.get_routing_probabilities()
+        self.edges = list(probabilities.keys())
+        self.edge_probability = np.array([probabilities[edge] for edge in self.edges])
+
+        # Activities are the stations of the network, an activity may be on more than one edge
+        self.activities = list(dict.fromkeys(edge[2] for edge in self.edges))
+        activity_index = {name: i for i, name in enumerate(self.activities)}
+        self.edge_activity = np.array([activity_index[edge[2]] for edge in self.edges], dtype=int)
+
+        # transition[e, f] is the probability that a person finishing edge e takes edge f next
+        edges_from = {}
+        for f, (u, _, _) in enumerate(self.edges):
+            edges_from.setdefault(u, []).append(f)
+
+        n = len(self.edges)
+        self.transition = np.zeros((n, n))
+        for e, (_, v, _) in enumerate(self.edges):
+            for f in edges_from.get(v, []):
+                self.transition[e, f] = self.edge_probability[f]
+
+        self.edges_from = edges_from
+
+    def get_arrival_rates(self, arrival_rates):
+        """Solve the traffic equations for the arrival rate at each activity
+
+        Arguments:
+            arrival_rates {dictionary} -- Decision node -> rate of external arrivals
+
+        Raises:
+            ValueError: The routing contains a loop that people never leave
+
+        Returns:
+            numpy array -- Arrival rate for each activity (in the order of self.activities)
+        """
+        external = np.zeros(len(self.edges))
+        for node_id, rate in arrival_rates.items():
+            for f in self.edges_from.get(node_id, []):
+                external[f] += rate * self.edge_probability[f]
+
+        try:
+            edge_rates = np.linalg.solve(np.eye(len(self.edges)) - self.transition.T, external)
+        except np.linalg.LinAlgError:
+            raise ValueError('Routing contains a loop with no exit, traffic equations are singular')
+
+        return np.bincount(self.edge_activity, weights=edge_rates, minlength=len(self.activities))
+
+    def solve(self, arrival_rates, service_params=None):
+        """Estimate utilisation, queue length and waits for each activity
+
+        Arguments:
+            arrival_rates {dictionary} -- Decision node -> rate of external arrivals
+
+        Keyword Arguments:
+            service_params {dictionary} -- Activity name -> dictionary of service parameters,
+                                           overriding the registered arguments (default: {None})
+
+        Raises:
+            ValueError: An activity does not have a mean service time, or its number of servers
+                        is not a positive integer
+
+        Returns:
+            DataFrame -- One row per activity with arrival_rate, servers, utilisation,
+                         prob_wait, queue_length, wait, time_in_activity and
+                         number_in_activity. Unstable activities have infinite queues.
+        """
+        service_params = service_params if service_params else {}
+        lam = self.get_arrival_rates(arrival_rates)
+
+        results = {column: [] for column in ['activity', 'arrival_rate', 'servers',
+                                             'mean_service_time', 'utilisation', 'prob_wait',
+                                             'queue_length', 'wait', 'time_in_activity',
+                                             'number_in_activity']}
+
+        for i, activity_name in enumerate(self.activities):
+            params = self._get_parameters(activity_name, service_params)
+            service_time = params['mean_service_time']
+            servers = params['servers']
+
+            if servers is None:
+                utilisation, prob_wait, wait = 0.0, 0.0, 0.0
+            else:
+                utilisation = lam[i] * service_time / servers
+                prob_wait = self.erlang_c(servers, lam[i] * service_time)
+                if utilisation < 1:
+                    wait = prob_wait * service_time / (servers * (1 - utilisation))
+                    wait *= (params['arrival_scv'] + params['service_scv']) / 2
+                else:
+                    wait = math.inf
+
+            results['activity'].append(activity_name)
+            results['arrival_rate'].append(lam[i])
+            results['servers'].append(servers)
+            results['mean_service_time'].append(service_time)
+            results['utilisation'].append(utilisation)
+            results['prob_wait'].append(prob_wait)
+            results['queue_length'].append(lam[i] * wait)
+            results['wait'].append(wait)
+            results['time_in_activity'].append(wait + service_time)
+            results['number_in_activity'].append(lam[i] * (wait + service_time))
+
+        return pd.DataFrame(results)
+
+    def _get_parameters(self, activity_name, service_params):
+        """Combine the service parameters, registered arguments and defaults for an activity"""
+        registered = {}
+        if activity_name in self.routing.get_activities():
+            _, registered = self.routing.get_activity_details(activity_name)
+
+        params = {}
+        overrides = service_params.get(activity_name, {})
+        for key, default in self.PARAMETER_DEFAULTS.items():
+            params[key] = overrides.get(key, registered.get(key, default))
+
+        if params['mean_service_time'] is None:
+            raise ValueError(f'Activity {activity_name} has no mean_service_time')
+
+        servers = params['servers']
+        if servers is not None:
+            # Whole numbers read from parameter tables (e.g. 2.0) are accepted
+            if (isinstance(servers, bool) or not isinstance(servers, numbers.Real)
+                    or not math.isfinite(servers) or servers != int(servers) or servers < 1):
+                raise ValueError(f'Activity {activity_name} servers must be a positive integer, '
+                                 f'received {servers!r}')
+            params['servers'] = int(servers)
+
+        return params
+
+    @staticmethod
+    def erlang_c(servers, offered_load):
+        """Probability that an arrival waits in an M/M/c queue
+
+        Arguments:
+            servers {int} -- Number of servers (c)
+            offered_load {float} -- Arrival rate multiplied by mean service time (a)
+
+        Returns:
+            float -- Probability of waiting, 1 if the queue is unstable
+        """
+        if offered_load >= servers:
+            return 1.0
+
+        # Erlang B by recurrence, then convert to Erlang C
+        erlang_b = 1.0
+        for k in range(1, servers + 1):
+            erlang_b = offered_load * erlang_b / (k + offered_load * erlang_b)
+
+        utilisation = offered_load / servers
+        return erlang_b / (1 - utilisation + utilisation * erlang_b)
@@ -0,0 +1,255 @@
+""" HealthDES - A python library to support discrete event simulation in health and social care """
+
+import itertools
+import math
+import zlib
+
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+# Import local libraries
+# pylint: disable=relative-beyond-top-level
+from .PersonBase import PersonBase
+
+# Uniforms drawn from the generator at a time by each stream
+STREAM_BLOCK = 64
+
+
+def _key_number(part):
+    """Return a number for part of a stream key which is stable across processes and runs"""
+    if isinstance(part, (int, np.integer)) and not isinstance(part, bool) and part >= 0:
+        return int(part)
+    return zlib.crc32(repr(part).encode('utf-8'))
+
+
+class RandomStream:
+    """ A stream of random numbers for one source of randomness in a model
+
+    Every draw uses exactly one uniform, transformed by inversion, so draws stay synchronised
+    between scenarios: the n-th draw from a stream is made from the same uniform whichever
+    distribution or parameters the scenario uses. In an antithetic stream each uniform u is
+    replaced by 1 - u.
+    """
+
+    def __init__(self, seed_sequence, antithetic=False):
+        """Create a stream
+
+        Arguments:
+            seed_sequence {numpy.random.SeedSequence} -- Seed for the stream
+
+        Keyword Arguments:
+            antithetic {bool} -- Use 1 - u in place of each uniform u (default: {False})
+        """
+        self.generator = np.random.Generator(np.random.PCG64(seed_sequence))
+        self.antithetic = antithetic
+        self.block = iter(())
+
+    def uniform(self, low=0.0, high=1.0):
+        """Draw from a uniform distribution"""
+        u = next(self.block, None)
+        if u is None:
+            uniforms = self.generator.random(STREAM_BLOCK)
+            if self.antithetic:
+                uniforms = 1.0 - uniforms
+            self.block = iter(uniforms.tolist())
+            u = next(self.block)
+        return low + (high - low) * u
+
+    def exponential(self, mean):
+        """Draw from an exponential distribution with the given mean"""
+        return -mean * math.log1p(-self.uniform())
+
+    def normal(self, mean, standard_deviation):
+        """Draw from a normal distribution"""
+        # The generator returns values in [0, 1), keep the uniform away from zero
+        u = min(max(self.uniform(), 1e-12), 1.0 - 1e-12)
+        return NormalDist(mean, standard_deviation).inv_cdf(u)
+
+    def lognormal(self, mu, sigma):
+        """Draw from a lognormal distribution with the parameters of the underlying normal"""
+        return math.exp(self.normal(mu, sigma))
+
+    def triangular(self, low, mode, high):
+        """Draw from a triangular distribution"""
+        u = self.uniform()
+        split = (mode - low) / (high - low)
+        if u < split:
+            return low + math.sqrt(u * (high - low) * (mode - low))
+        return high - math.sqrt((1.0 - u) * (high - low) * (high - mode))
+
+    def choice(self, options, probabilities=None):
+        """Choose one of the options, with equal probabilities if none are given"""
+        u = self.uniform()
+        if probabilities is None:
+            return options[min(int(u * len(options)), len(options) - 1)]
+
+        for option, cumulative in zip(options, itertools.accumulate(probabilities)):
+            if u < cumulative:
+                return option
+        return options[-1]
+
+
+class RandomStreams:
+    """ Class to provide synchronised random number streams for common random numbers
+
+    Each source of randomness in a model draws from its own stream, identified by a key such as
+    'arrivals' or ('triage', PID). The stream for a key depends only on the seed, the replication
+    and the key, so running each scenario with the same seed and replication gives the same
+    patient the same arrival time and service times wherever the scenarios do not differ (common
+    random numbers). Activities reach the streams through simulation_params['random_streams'].
+
+    An antithetic replication uses 1 - u for every uniform u of the replication with the same
+    number, giving negatively correlated pairs of replications.
+
+    Example:
+        streams = simulation_params['random_streams']
+        duration = streams.for_person(self.person, self.activity_name).exponential(20)
+    """
+
+    def __init__(self, seed, replication=0, antithetic=False):
+        """Create the streams for one replication
+
+        Arguments:
+            seed {int} -- Seed shared by all scenarios being compared
+
+        Keyword Arguments:
+            replication {int} -- Replication number (default: {0})
+            antithetic {bool} -- Antithetic partner of the replication (default: {False})
+        """
+        self.seed = seed
+        self.replication = replication
+        self.antithetic = antithetic
+        self.streams = {}
+
+    def stream(self, *key):
+        """Return the stream for a key, creating it on first use
+
+        Returns:
+            RandomStream -- The stream
+        """
+        stream = self.streams.get(key, None)
+        if stream is None:
+            seed_sequence = np.random.SeedSequence(
+                self.seed, spawn_key=(self.replication,) + tuple(_key_number(k) for k in key))
+            stream = RandomStream(seed_sequence, self.antithetic)
+            self.streams[key] = stream
+        return stream
+
+    def for_person(self, person, name):
+        """Return the stream for a person's draws from a named source, such as an activity
+
+        Arguments:
+            person {PersonBase} -- The person
+            name {str} -- Name of the source of randomness
+
+        Returns:
+            RandomStream -- The stream
+        """
+        return self.stream(name, person.PID)
+
+
+def run_replications(model, scenarios, replications, seed=0, antithetic=False, metrics=None):
+    """Run every scenario for each replication with common random numbers
+
+    For each replication, every scenario is run with streams created from the same seed and
+    replication, with person IDs restarting from zero, so that differences between the scenarios
+    are not hidden by sampling noise. With antithetic True each replication is also run as its
+    antithetic partner. The person ID counter of the calling process is restored afterwards.
+
+    Args:
+        model (function): Function called as model(scenario_params, random_streams) which runs the
+                          simulation and returns its DataCollection
+        scenarios (dict): Scenario name -> parameters passed to the model
+        replications (int): Number of replications (pairs of replications if antithetic)
+        seed (int): Seed shared by the scenarios (default: 0)
+        antithetic (bool): Also run the antithetic partner of each replication (default: False)
+        metrics (function): Function returning a dictionary of metric name -> value from a
+                            DataCollection (default: the counters of the DataCollection)
+
+    Returns:
+        DataFrame: scenario, replication, antithetic, metric and value for each run and metric
+    """
+    if metrics is None:
+        def metrics(dc):
+            return dict(dc.counters)
+
+    rows = []
+    for replication in range(replications):
+        for is_antithetic in ((False, True) if antithetic else (False,)):
+            for scenario, params in scenarios.items():
+                with PersonBase.person_ids():
+                    dc = model(params, RandomStreams(seed, replication, is_antithetic))
+                for metric, value in metrics(dc).items():
+                    rows.append((scenario, replication, is_antithetic, metric, value))
+
+    return pd.DataFrame(rows, columns=['scenario', 'replication', 'antithetic', 'metric',
+                                       'value'])
+
+
+def _ratio(numerator, denominator):
+    """Return numerator / denominator, infinite for a zero denominator unless both are zero"""
+    if denominator > 0:
+        return numerator / denominator
+    return math.inf if numerator > 0 else math.nan
+
+
+def compare_scenarios(results, baseline, alternative):
+    """Estimate the difference in each metric between two scenarios and the variance reduction
+
+    Antithetic partners are averaged into one observation per replication. The paired variance
+    of the mean difference is estimated from the paired differences, so it reflects both common
+    random numbers and antithetic pairing. The independent variance is what the same number of
+    simulation runs of each scenario would give with independent random numbers, estimated from
+    the variance between the runs which are not antithetic. The reduction ratio is the
+    independent variance divided by the paired variance; a ratio of four means a quarter of the
+    simulation runs give the same precision.
+
+    Args:
+        results (DataFrame): Results returned by run_replications
+        baseline (str): Name of the baseline scenario
+        alternative (str): Name of the scenario compared with the baseline
+
+    Raises:
+        ValueError: A scenario is not in the results or there are fewer than two replications
+
+    Returns:
+        DataFrame: For each metric, the replications, baseline and alternative means, mean
+                   difference, paired and independent variance of the mean difference, reduction
+                   ratio and 95% confidence half width of the difference
+    """
+    for scenario in (baseline, alternative):
+        if scenario not in set(results['scenario']):
+            raise ValueError(f'Scenario {scenario} not in results')
+
+    means = results.groupby(['metric', 'scenario', 'replication'])['value'].mean()
+    means = means.unstack('scenario')[[baseline, alternative]].dropna()
+
+    # Between run variance without antithetic pairing and the number of runs of each scenario
+    run_variance = (results[~results['antithetic'].astype(bool)]
+                    .groupby(['metric', 'scenario'])['value'].var(ddof=1))
+    runs = results.groupby(['metric', 'scenario']).size()
+
+    z = NormalDist().inv_cdf(0.975)
+    rows = []
+    for metric, values in means.groupby(level='metric'):
+        n = len(values)
+        if n < 2:
+            raise ValueError(f'At least two replications are needed to compare {metric}')
+
+        difference = values[alternative] - values[baseline]
+        paired_variance = difference.var(ddof=1) / n
+        independent_variance = (run_variance[(metric, baseline)] / runs[(metric, baseline)] +
+                                run_variance[(metric, alternative)] / runs[(metric, alternative)])
+        rows.append({'metric': metric,
+                     'replications': n,
+                     'baseline_mean': values[baseline].mean(),
+                     'alternative_mean': values[alternative].mean(),
+                     'difference': difference.mean(),
+                     'paired_variance': paired_variance,
+                     'independent_variance': independent_variance,
+                     'reduction_ratio': _ratio(independent_variance, paired_variance),
+                     'half_width': z * math.sqrt(paired_variance)})
+
+    return pd.DataFrame(rows)
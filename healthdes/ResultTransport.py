@@ -0,0 +1,224 @@
+""" HealthDES - A python library to support discrete event simulation in health and social care """
+
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# Columns are written at offsets aligned to this many bytes
+ALIGNMENT = 8
+
+
+def _align(offset):
+    """Round an offset up to the next aligned position"""
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _encode_column(series):
+    """Return a fixed width numpy array for a column and, for text columns, the categories
+
+    Numeric and boolean columns are written as they are. Other columns are factorised into int32
+    codes (-1 for missing values) and a list of categories.
+    """
+    if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+        return np.ascontiguousarray(series.to_numpy()), None
+
+    codes, categories = pd.factorize(series)
+    return codes.astype(np.int32), list(categories)
+
+
+def export_results(dc, directory=None):
+    """Write the reports of a DataCollection instance to a shared memory block or file
+
+    Each report is converted to columns which are written one after another into a single
+    block. Only the manifest describing the block is returned, so a worker process returns a
+    small picklable dictionary rather than pickling its DataFrames. The block remains until the
+    parent process calls gather_results.
+
+    Args:
+        dc (DataCollection): Data collection for a completed simulation run
+        directory (str): If given, results are written to a memory mapped file in this directory
+                         rather than to shared memory (default: None)
+
+    Returns:
+        dict: The manifest describing the reports and where they are stored
+    """
+    reports = {}
+    columns = []
+    offset = 0
+    for report_name in dc.get_list_of_reports():
+        df = dc.get_results(report_name)
+        report_columns = []
+        for column in df.columns:
+            values, categories = _encode_column(df[column])
+            offset = _align(offset)
+            report_columns.append({'name': column,
+                                   'dtype': values.dtype.str,
+                                   'offset': offset,
+                                   'categories': categories})
+            columns.append((offset, values))
+            offset += values.nbytes
+        reports[report_name] = {'rows': len(df), 'columns': report_columns}
+
+    size = max(offset, 1)
+    manifest = {'simulation_name': dc.simulation_name,
+                'simulation_run': dc.simulation_run,
+                'counters': dict(dc.counters),
+                'reports': reports}
+
+    if directory is None:
+        from multiprocessing import shared_memory, resource_tracker
+
+        block = shared_memory.SharedMemory(create=True, size=size)
+        _write_columns(block.buf, columns)
+        manifest['shared_memory'] = block.name
+        # The parent process unlinks the block once gathered, so this process must not
+        # remove it when it exits
+        resource_tracker.unregister(block._name, 'shared_memory')
+        block.close()
+    else:
+        handle, path = tempfile.mkstemp(suffix='.results', dir=directory)
+        os.close(handle)
+        buffer = np.memmap(path, dtype=np.uint8, mode='w+', shape=(size,))
+        _write_columns(buffer, columns)
+        buffer.flush()
+        del buffer
+        manifest['file'] = path
+
+    return manifest
+
+
+def _write_columns(buffer, columns):
+    """Copy each column into the buffer at its offset"""
+    for offset, values in columns:
+        view = np.frombuffer(buffer, dtype=values.dtype, count=len(values), offset=offset)
+        view[:] = values
+        del view
+
+
+def gather_results(manifests, release=True):
+    """Combine the reports written by export_results into one DataFrame per report
+
+    Columns are read directly from each worker's block and concatenated, so the only copy made
+    is into the combined table. Text columns are returned as pandas categoricals with the
+    categories of all workers combined.
+
+    Args:
+        manifests (list): Manifests returned by export_results
+        release (bool): Unlink the shared memory blocks and delete the files once gathered
+                        (default: True)
+
+    Returns:
+        dict: Report name -> combined DataFrame
+    """
+    buffers = []
+    try:
+        for manifest in manifests:
+            buffers.append(_open_buffer(manifest))
+
+        report_names = list(dict.fromkeys(report_name
+                                          for manifest in manifests
+                                          for report_name in manifest['reports']))
+
+        results = {}
+        for report_name in report_names:
+            parts = [(manifest['reports'][report_name], buffer)
+                     for manifest, (_, buffer) in zip(manifests, buffers)
+                     if report_name in manifest['reports']]
+            results[report_name] = _gather_report(parts)
+    finally:
+        # Release references to the buffers before closing them
+        handles = [handle for handle, _ in buffers]
+        del buffers[:]
+        for manifest, handle in zip(manifests, handles):
+            _close_buffer(manifest, handle, release)
+
+    return results
+
+
+def gather_counters(manifests):
+    """Return the counters of each run returned by export_results
+
+    Args:
+        manifests (list): Manifests returned by export_results
+
+    Returns:
+        DataFrame: One row per run and counter
+    """
+    counters = {'simulation_name': [], 'simulation_run': [], 'counter': [], 'value': []}
+    for manifest in manifests:
+        for counter, value in manifest['counters'].items():
+            counters['simulation_name'].append(manifest['simulation_name'])
+            counters['simulation_run'].append(manifest['simulation_run'])
+            counters['counter'].append(counter)
+            counters['value'].append(value)
+
+    return pd.DataFrame(counters)
+
+
+def _open_buffer(manifest):
+    """Attach to the shared memory block or memory map the file named in a manifest"""
+    if 'shared_memory' in manifest:
+        from multiprocessing import shared_memory
+
+        block = shared_memory.SharedMemory(name=manifest['shared_memory'])
+        return block, block.buf
+
+    buffer = np.memmap(manifest['file'], dtype=np.uint8, mode='r')
+    return None, buffer
+
+
+def _close_buffer(manifest, handle, release):
+    """Detach from a shared memory block or file and optionally remove it"""
+    if handle is not None:
+        handle.close()
+        if release:
+            handle.unlink()
+    elif release:
+        os.remove(manifest['file'])
+
+
+def _gather_report(parts):
+    """Concatenate the columns of one report from each worker's buffer"""
+    column_names = list(dict.fromkeys(column['name']
+                                      for report, _ in parts
+                                      for column in report['columns']))
+
+    data = {}
+    for column_name in column_names:
+        columns = [(report, buffer, next((c for c in report['columns']
+                                          if c['name'] == column_name), None))
+                   for report, buffer in parts]
+        is_categorical = any(column is not None and column['categories'] is not None
+                             for _, _, column in columns)
+
+        arrays = []
+        categories = {}
+        for report, buffer, column in columns:
+            if column is None:
+                arrays.append(np.full(report['rows'], -1 if is_categorical else np.nan))
+                continue
+
+            values = np.frombuffer(buffer, dtype=np.dtype(column['dtype']),
+                                   count=report['rows'], offset=column['offset'])
+            if is_categorical:
+                column_categories = column['categories']
+                if column_categories is None:
+                    values, column_categories = pd.factorize(values)
+                # Map each worker's codes onto the combined categories, -1 stays missing
+                for category in column_categories:
+                    categories.setdefault(category, len(categories))
+                mapping = np.array([categories[c] for c in column_categories] + [-1],
+                                   dtype=np.int32)
+                values = mapping[values]
+            arrays.append(values)
+
+        combined = np.concatenate(arrays)
+        if is_categorical:
+            data[column_name] = pd.Categorical.from_codes(combined.astype(np.int32),
+                                                          categories=list(categories))
+        else:
+            data[column_name] = combined
+
+    return pd.DataFrame(data, columns=column_names)
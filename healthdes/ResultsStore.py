@@ -0,0 +1,252 @@
+""" HealthDES - A python library to support discrete event simulation in health and social care """
+
+import json
+import sqlite3
+
+import pandas as pd
+
+
+def _quote(identifier):
+    """Quote an identifier (table or column name) for use in SQLite statements"""
+    return '"' + str(identifier).replace('"', '""') + '"'
+
+
+class ResultsStore:
+    """ Class to index results from many simulation runs in a local SQLite database
+
+    Each report recorded by a DataCollection instance is stored in its own table named
+    'report_<report name>'. A 'runs' table records the parameters and seed used for each run and
+    a 'counters' table holds the final value of the data collection counters. Results are
+    inserted in bulk within a single transaction per run and the tables are indexed on
+    simulation_name, simulation_run, time and any key columns so that filtered analysis across
+    runs does not require a full scan, or loading every run into pandas.
+    """
+
+    RUNS_TABLE = 'runs'
+    COUNTERS_TABLE = 'counters'
+    REPORT_PREFIX = 'report_'
+
+    def __init__(self, database=':memory:'):
+        """Open (or create) the results database
+
+        Args:
+            database (str): Path to the SQLite database file (default: in-memory database)
+        """
+        self.database = database
+        self.connection = sqlite3.connect(database)
+
+        with self.connection:
+            self.connection.execute(
+                f'CREATE TABLE IF NOT EXISTS {self.RUNS_TABLE} ('
+                'simulation_name TEXT, simulation_run INTEGER, seed INTEGER, parameters TEXT, '
+                'PRIMARY KEY (simulation_name, simulation_run))')
+            self.connection.execute(
+                f'CREATE TABLE IF NOT EXISTS {self.COUNTERS_TABLE} ('
+                'simulation_name TEXT, simulation_run INTEGER, counter TEXT, value REAL, '
+                'PRIMARY KEY (simulation_name, simulation_run, counter))')
+
+    def close(self):
+        """Close the connection to the database"""
+        self.connection.close()
+
+    def report_table(self, report_name):
+        """Return the name of the table holding a report
+
+        Args:
+            report_name (str): Name of the report in the DataCollection
+
+        Returns:
+            str: Name of the table in the database
+        """
+        return self.REPORT_PREFIX + report_name
+
+    def ingest(self, dc, parameters=None, seed=None, key_columns=None):
+        """Store all reports and counters from a DataCollection instance
+
+        Args:
+            dc (DataCollection): Data collection for a completed simulation run
+            parameters (dict): JSON serialisable parameters used for the run (default: None)
+            seed (int): Random number seed used for the run (default: None)
+            key_columns (dict): Report name -> list of additional columns to index
+                                (default: None)
+        """
+        frames = {}
+        for report_name in dc.get_list_of_reports():
+            frames[report_name] = dc.get_results(report_name)
+
+        self.ingest_frames(dc.simulation_name, dc.simulation_run, frames,
+                           counters=dc.counters,
+                           parameters=parameters,
+                           seed=seed,
+                           key_columns=key_columns)
+
+    def ingest_frames(self, simulation_name, simulation_run, frames, counters=None,
+                      parameters=None, seed=None, key_columns=None):
+        """Store a dictionary of report DataFrames for a single simulation run
+
+        Re-ingesting a run replaces the rows previously stored for that run.
+
+        Args:
+            simulation_name (str): The name of the simulation
+            simulation_run (int): The sequence number for this run of the simulation
+            frames (dict): Report name -> pandas DataFrame
+            counters (dict): Counter name -> value (default: None)
+            parameters (dict): JSON serialisable parameters used for the run (default: None)
+            seed (int): Random number seed used for the run (default: None)
+            key_columns (dict): Report name -> list of additional columns to index
+                                (default: None)
+        """
+        key_columns = key_columns if key_columns else {}
+        run_key = (simulation_name, simulation_run)
+
+        with self.connection:
+            self.connection.execute(
+                f'INSERT OR REPLACE INTO {self.RUNS_TABLE} VALUES (?, ?, ?, ?)',
+                run_key + (seed, json.dumps(parameters, default=str)))
+
+            self.connection.execute(
+                f'DELETE FROM {self.COUNTERS_TABLE} '
+                'WHERE simulation_name IS ? AND simulation_run IS ?', run_key)
+            if counters:
+                self.connection.executemany(
+                    f'INSERT INTO {self.COUNTERS_TABLE} VALUES (?, ?, ?, ?)',
+                    [run_key + (name, value) for name, value in counters.items()])
+
+            for report_name, df in frames.items():
+                if df is None:
+                    continue
+                self._insert_report(report_name, df, run_key, key_columns.get(report_name, []))
+
+    def _insert_report(self, report_name, df, run_key, key_columns):
+        """Create or extend a report table, replace the rows for this run and index it"""
+        table = _quote(self.report_table(report_name))
+
+        existing = {row[1] for row in self.connection.execute(f'PRAGMA table_info({table})')}
+        if not existing:
+            column_definitions = ', '.join(f'{_quote(column)} {self._sql_type(df[column])}'
+                                           for column in df.columns)
+            self.connection.execute(f'CREATE TABLE {table} ({column_definitions})')
+        else:
+            for column in df.columns:
+                if column not in existing:
+                    self.connection.execute(f'ALTER TABLE {table} ADD COLUMN '
+                                            f'{_quote(column)} {self._sql_type(df[column])}')
+
+        self.connection.execute(f'DELETE FROM {table} '
+                                'WHERE simulation_name IS ? AND simulation_run IS ?', run_key)
+
+        # SQLite cannot bind NaN as NULL, so convert missing values to None before inserting
+        rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+        column_list = ', '.join(_quote(column) for column in df.columns)
+        placeholders = ', '.join('?' * len(df.columns))
+        self.connection.executemany(f'INSERT INTO {table} ({column_list}) VALUES ({placeholders})',
+                                    rows)
+
+        index_columns = [('simulation_run',), ('simulation_name', 'simulation_run'), ('time',)]
+        index_columns += [(column,) for column in key_columns]
+        for columns in index_columns:
+            if not all(column in df.columns for column in columns):
+                continue
+            index_name = _quote('ix_' + self.report_table(report_name) + '_' + '_'.join(columns))
+            self.connection.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON {table} '
+                                    f'({", ".join(_quote(column) for column in columns)})')
+
+    @staticmethod
+    def _sql_type(series):
+        """Map a pandas column to a SQLite column affinity"""
+        if pd.api.types.is_bool_dtype(series) or pd.api.types.is_integer_dtype(series):
+            return 'INTEGER'
+        if pd.api.types.is_float_dtype(series):
+            return 'REAL'
+        return 'TEXT'
+
+    def get_runs(self):
+        """Return the runs held in the store
+
+        Returns:
+            DataFrame: One row per run with simulation name, run, seed and parameters (as JSON)
+        """
+        return self.query(f'SELECT * FROM {self.RUNS_TABLE} '
+                          'ORDER BY simulation_name, simulation_run')
+
+    def get_counters(self, simulation_name=None):
+        """Return the counters held in the store
+
+        Args:
+            simulation_name (str): Only return counters for this simulation (default: None)
+
+        Returns:
+            DataFrame: One row per run and counter
+        """
+        if simulation_name is None:
+            return self.query(f'SELECT * FROM {self.COUNTERS_TABLE}')
+        return self.query(f'SELECT * FROM {self.COUNTERS_TABLE} WHERE simulation_name = ?',
+                          (simulation_name,))
+
+    def get_list_of_reports(self):
+        """ Get a list of reports held in the store
+
+        Return: list of reports
+        """
+        cursor = self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                                         'AND name LIKE ? ORDER BY name',
+                                         (self.REPORT_PREFIX + '%',))
+        return [row[0][len(self.REPORT_PREFIX):] for row in cursor]
+
+    def select(self, report_name, columns=None, simulation_name=None, simulation_run=None,
+               start_time=None, end_time=None, where=None):
+        """Return rows from a report filtered on the indexed columns
+
+        Args:
+            report_name (str): Name of the report
+            columns (list): Columns to return (default: all columns)
+            simulation_name (str or list): Simulation name(s) to select (default: all)
+            simulation_run (int or list): Simulation run(s) to select (default: all)
+            start_time (float): Return rows with time >= start_time (default: None)
+            end_time (float): Return rows with time < end_time (default: None)
+            where (dict): Column name -> value (or list of values) to match (default: None)
+
+        Returns:
+            DataFrame: The selected rows
+        """
+        filters = dict(where) if where else {}
+        if simulation_name is not None:
+            filters['simulation_name'] = simulation_name
+        if simulation_run is not None:
+            filters['simulation_run'] = simulation_run
+
+        clauses = []
+        params = []
+        for column, value in filters.items():
+            if isinstance(value, (list, tuple, set)):
+                value = list(value)
+                clauses.append(f'{_quote(column)} IN ({", ".join("?" * len(value))})')
+                params.extend(value)
+            else:
+                clauses.append(f'{_quote(column)} = ?')
+                params.append(value)
+        if start_time is not None:
+            clauses.append('time >= ?')
+            params.append(start_time)
+        if end_time is not None:
+            clauses.append('time < ?')
+            params.append(end_time)
+
+        column_list = ', '.join(_quote(column) for column in columns) if columns else '*'
+        sql = f'SELECT {column_list} FROM {_quote(self.report_table(report_name))}'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+
+        return self.query(sql, params)
+
+    def query(self, sql, params=()):
+        """Run a SQL query against the store
+
+        Args:
+            sql (str): SQL query
+            params (sequence or dict): Query parameters (default: none)
+
+        Returns:
+            DataFrame: Query results
+        """
+        return pd.read_sql_query(sql, self.connection, params=params)
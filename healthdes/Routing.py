@@ -1,20 +1,27 @@
 """ HealthDES - A python library to support discrete event simulation in health and social care """
 
+import math
 import networkx as nx
+import numpy as np
 
 from dataclasses import dataclass
+from types import MappingProxyType
 from typing import Any, Dict
 
+# Decision node at which people leave the system (see PersonBase.get_next_node)
+END_NODE = 'end'
+
 
 # TODO: Improve type hinting to remove Any.
 #       activity_class->ActivityBase,
 #       Dict(str, Any)->Dict(str, [int, float, str])
 @dataclass(frozen=True)
 class Activity_ID:
-    __slots__ = ['next_activity_id', 'activity_class', 'kwargs']
+    __slots__ = ['next_activity_id', 'activity_class', 'kwargs', 'activity_name']
     next_activity_id: str
     activity_class: Any
     kwargs: Dict[str, Any]
+    activity_name: str
 
 
 class Routing:
@@ -45,6 +52,18 @@ class Routing:
         # Dictionary of activities and reference to implementation classes
         self.activities = {}
 
+        # Activity_ID returned for each node, shared by everyone routed through the node.
+        # Cleared whenever the graph or activity registry is changed.
+        self.activity_cache = {}
+
+        # RoutingIndex built on first use, discarded whenever the graph or registry is changed
+        self.index = None
+
+    def _invalidate(self):
+        """Discard everything precomputed from the graph and activity registry"""
+        self.activity_cache.clear()
+        self.index = None
+
     # Methods to interact with the activity dictionary
     def register_activity(self, activity_name, activity_class, arguments):
         """Register an activity with the activity registry
@@ -53,8 +72,11 @@ class Routing:
             activity_name {str} -- Name of the activity to register
             activity_class {class obj} -- Activity class, a child instance of this class
             arguments {dictionary} -- dictionary of arguments passed to the activity when called
+
+        The arguments are copied into a read-only mapping shared by every instance of the activity.
         """
-        self.activities[activity_name] = (activity_class, arguments)
+        self.activities[activity_name] = (activity_class, MappingProxyType(dict(arguments)))
+        self._invalidate()
 
     def get_activities(self):
         """Get the list of registered activities
@@ -71,11 +93,53 @@ class Routing:
             activity_name {string} -- Name of the activity
 
         Returns:
-            (class obj, dictionary) -- Class for the activity, parameters to pass to activity
-                                       when instance created
+            (class obj, mapping) -- Class for the activity, read-only parameters to pass to
+                                    activity when instance created
         """
         return self.activities[activity_name]
 
+    def get_activity_resources(self, activity_name):
+        """Return the names of the resources an activity uses
+
+        Resources are read from the registered arguments 'resources' (a list of names, or a
+        single name) and 'resource' (a single name).
+
+        Arguments:
+            activity_name {string} -- Name of the activity
+
+        Returns:
+            frozenset -- Names of the resources used by the activity
+        """
+        _, arguments = self.activities[activity_name]
+        resources = arguments.get('resources', ())
+        resources = {resources} if isinstance(resources, str) else set(resources)
+        if arguments.get('resource', None) is not None:
+            resources.add(arguments['resource'])
+
+        return frozenset(resources)
+
+    def get_subrouting(self, nodes):
+        """Return a new routing containing only the given decision nodes
+
+        Arguments:
+            nodes {iterable} -- The decision nodes to keep
+
+        Returns:
+            Routing -- Routing with the nodes, the activities between them and their registrations
+        """
+        nodes = set(nodes)
+        routing = Routing()
+        for node_id in self.G.nodes:
+            if node_id in nodes:
+                routing.add_decision(node_id)
+        for u, v, key, probability in self.G.edges(keys=True, data='probability'):
+            if u in nodes and v in nodes:
+                if key not in routing.activities:
+                    routing.register_activity(key, *self.activities[key])
+                routing.add_activity(key, u, v, probability)
+
+        return routing
+
     # Methods to interact with the routing graph
     # TODO: Switch nodes and edges around - Node is the activity, edges are the transitions
     #  between activities (better for display)
@@ -83,18 +147,72 @@ class Routing:
         """Create a decision point in the graph with decision function"""
 
         node_id = self.G.add_node(name)
+        self._invalidate()
 
         return node_id
 
-    def add_activity(self, name, starting_node, ending_node):
+    def add_activity(self, name, starting_node, ending_node, probability=None):
         """Create a directed between two nodes edge in the graph with a specific activity attached
+
+        The optional probability is the proportion of people leaving the starting node who take
+        this activity, it is used by analytic estimates of the network (see QueueingNetwork).
         """
-        edge_id = self.G.add_edge(starting_node, ending_node, name)
+        if probability is None:
+            edge_id = self.G.add_edge(starting_node, ending_node, name)
+        else:
+            edge_id = self.G.add_edge(starting_node, ending_node, name, probability=probability)
+        self._invalidate()
 
         return edge_id
 
+    def get_routing_probabilities(self):
+        """Return the probability of taking each activity when leaving its starting node
+
+        Edges without a probability share the probability not assigned to other edges leaving
+        the same node equally.
+
+        Raises:
+            ValueError: The probabilities of edges leaving a node are greater than one
+
+        Returns:
+            Dictionary -- (starting node, ending node, activity name) -> probability
+        """
+        probabilities = {}
+        for node_id in self.G.nodes:
+            edges = list(self.G.out_edges(node_id, keys=True, data='probability'))
+            assigned = sum(p for _, _, _, p in edges if p is not None)
+            unassigned = [edge for edge in edges if edge[3] is None]
+            if assigned > 1 + 1e-9:
+                raise ValueError(f'Routing probabilities from {node_id} are greater than one')
+
+            for u, v, key, p in edges:
+                if p is None:
+                    p = (1 - assigned) / len(unassigned)
+                probabilities[(u, v, key)] = p
+
+        return probabilities
+
+    def get_index(self):
+        """Return the reachability, expected visit and downstream resource index of the routing
+
+        The index is built on first use and rebuilt after the graph or registry is changed.
+
+        Returns:
+            RoutingIndex -- The index
+        """
+        if self.index is None:
+            self.index = RoutingIndex(self)
+
+        return self.index
+
     def get_activity(self, node_id):
-        """Determine the next activity, return both the activity and next node ID"""
+        """Determine the next activity, return both the activity and next node ID
+
+        The Activity_ID returned is shared, per-person state is held in an ActivityContext.
+        """
+        activity = self.activity_cache.get(node_id, None)
+        if activity is not None:
+            return activity
 
         # TODO: This assumes we only have one possible edge from Node, the code will need to be
         # developed to include routing logic. Need a *decision method* to calculate next_activity_id
@@ -105,8 +223,203 @@ class Routing:
             for items in self.G.out_edges(node_id, keys=True):
                 _,  next_id, activity_id = items
             activity_class, arguments = self.activities[activity_id]
-            activity = Activity_ID(next_id, activity_class, arguments)
+            activity = Activity_ID(next_id, activity_class, arguments, activity_id)
         else:
-            activity = Activity_ID(None, None, None)
+            activity = Activity_ID(None, None, None, None)
 
+        self.activity_cache[node_id] = activity
         return activity
+
+
+class RoutingIndex:
+    """ Precomputed answers to questions about a routing graph
+
+    The index is built once from the graph and then answers each query in constant time:
+
+    Reachability    Nodes reachable from each node, a node reaches itself. Held as a bitset
+                    (an int with one bit per node) computed over the strongly connected
+                    components of the graph.
+    Resources       Names of the resources used by activities downstream of each node (see
+                    Routing.get_activity_resources), including activities leaving the node.
+    Expected visits Expected number of times a person at a node visits each node before leaving
+                    the system, using the routing probabilities (see
+                    Routing.get_routing_probabilities) and the fundamental matrix of the absorbing
+                    Markov chain. Nodes without outgoing activities, such as 'end', absorb people.
+                    Nodes in a part of the graph which people can enter but never leave are
+                    visited an infinite number of times.
+    Remaining       Expected number of activities a person at a node performs before leaving,
+                    infinite if the person may never leave.
+
+    Expected visits and remaining activities are built on first use, so reachability and
+    resources are available even if the routing probabilities are invalid.
+    """
+
+    def __init__(self, routing):
+        """Build the index
+
+        Arguments:
+            routing {Routing} -- The routing graph
+        """
+        self.routing = routing
+        self.nodes = list(routing.G.nodes)
+        self.node_index = {node_id: i for i, node_id in enumerate(self.nodes)}
+
+        self.reachable = self._propagate(routing.G, {node_id: 1 << i for node_id, i
+                                                     in self.node_index.items()})
+        self._build_downstream_resources()
+
+        self.visits = None
+        self.remaining_activities = None
+
+    @staticmethod
+    def _propagate(graph, bits):
+        """Return, for each node, the union of the bitsets of every node reachable from it
+
+        Components are visited in reverse topological order so each component's successors are
+        complete before it.
+        """
+        condensed = nx.condensation(graph)
+
+        component_bits = {}
+        reachable = {}
+        for component in reversed(list(nx.topological_sort(condensed))):
+            members = condensed.nodes[component]['members']
+            union = 0
+            for node_id in members:
+                union |= bits.get(node_id, 0)
+            for successor in condensed.successors(component):
+                union |= component_bits[successor]
+
+            component_bits[component] = union
+            for node_id in members:
+                reachable[node_id] = union
+
+        return reachable
+
+    def _build_downstream_resources(self):
+        """Build the set of resources downstream of each node from bitsets of resource names"""
+        routing = self.routing
+        resource_index = {}
+        bits = {}
+        for u, _, activity_name in routing.G.edges(keys=True):
+            if activity_name in routing.activities:
+                for resource in routing.get_activity_resources(activity_name):
+                    i = resource_index.setdefault(resource, len(resource_index))
+                    bits[u] = bits.get(u, 0) | 1 << i
+
+        resource_names = list(resource_index)
+        resource_sets = {}
+        self.downstream_resources = {}
+        for node_id, resource_bits in self._propagate(routing.G, bits).items():
+            resources = resource_sets.get(resource_bits, None)
+            if resources is None:
+                resources = frozenset(name for i, name in enumerate(resource_names)
+                                      if resource_bits >> i & 1)
+                resource_sets[resource_bits] = resources
+            self.downstream_resources[node_id] = resources
+
+    def _build_expected_visits(self):
+        """Build the expected visits between nodes and the expected remaining activities"""
+        routing = self.routing
+        n = len(self.nodes)
+        probabilities = routing.get_routing_probabilities()
+
+        transition = np.zeros((n, n))
+        leaving = np.zeros(n)
+        positive = nx.DiGraph()
+        positive.add_nodes_from(self.nodes)
+        for (u, v, _), probability in probabilities.items():
+            transition[self.node_index[u], self.node_index[v]] += probability
+            leaving[self.node_index[u]] += probability
+            if probability > 0:
+                positive.add_edge(u, v)
+
+        absorbing = np.array([routing.G.out_degree(node_id) == 0 for node_id in self.nodes],
+                             dtype=bool)
+        absorbing_bits = sum(1 << i for i in np.flatnonzero(absorbing).tolist())
+
+        # Nodes people reach with a positive probability, and whether they can leave from them
+        reachable = self._propagate(positive, {node_id: 1 << i for node_id, i
+                                               in self.node_index.items()})
+        can_leave = np.array([bool(reachable[node_id] & absorbing_bits) for node_id in self.nodes],
+                             dtype=bool)
+        trapped = np.flatnonzero(~can_leave)
+        trapped_bits = sum(1 << i for i in trapped.tolist())
+        t = np.flatnonzero(can_leave & ~absorbing)
+        a = np.flatnonzero(absorbing)
+
+        # Fundamental matrix N = (I - Q)^-1 over nodes people can leave from, people starting at
+        # an absorbing node visit only that node. Nobody returns from a trapped node, so visits
+        # to other nodes are unaffected by the people who become trapped.
+        visits = np.zeros((n, n))
+        visits[a, a] = 1.0
+        fundamental = np.linalg.inv(np.eye(len(t)) - transition[np.ix_(t, t)])
+        visits[np.ix_(t, t)] = fundamental
+        visits[np.ix_(t, a)] = fundamental @ transition[np.ix_(t, a)]
+
+        remaining = {}
+        for i, node_id in enumerate(self.nodes):
+            bits = reachable[node_id]
+            for j in trapped.tolist():
+                if bits >> j & 1:
+                    visits[i, j] = math.inf
+            # Each visit to a node is followed by an activity with the probability of leaving it
+            remaining[node_id] = (math.inf if bits & trapped_bits
+                                  else float(visits[i, t] @ leaving[t]))
+
+        self.visits = visits
+        self.remaining_activities = remaining
+
+    def can_reach(self, node_id, target_node_id):
+        """Return True if a person at a node can reach the target node
+
+        Arguments:
+            node_id {str} -- Starting decision node
+            target_node_id {str} -- Target decision node
+        """
+        return bool(self.reachable[node_id] >> self.node_index[target_node_id] & 1)
+
+    def can_reach_end(self, node_id):
+        """Return True if a person at a node can reach the 'end' node"""
+        return END_NODE in self.node_index and self.can_reach(node_id, END_NODE)
+
+    def get_reachable(self, node_id):
+        """Return the set of nodes reachable from a node, decoded from its bitset
+
+        Returns:
+            set -- Reachable decision nodes, including the node
+        """
+        bits = self.reachable[node_id]
+        return {target for target, i in self.node_index.items() if bits >> i & 1}
+
+    def get_expected_visits(self, node_id, target_node_id):
+        """Return the expected number of visits to the target node by a person at a node
+
+        A person's visit to the node they start at is counted.
+
+        Raises:
+            ValueError: The routing probabilities from a node are greater than one
+        """
+        if self.visits is None:
+            self._build_expected_visits()
+
+        return float(self.visits[self.node_index[node_id], self.node_index[target_node_id]])
+
+    def get_expected_remaining_activities(self, node_id):
+        """Return the expected number of activities a person at a node performs before leaving
+
+        Raises:
+            ValueError: The routing probabilities from a node are greater than one
+        """
+        if self.remaining_activities is None:
+            self._build_expected_visits()
+
+        return self.remaining_activities[node_id]
+
+    def get_downstream_resources(self, node_id):
+        """Return the names of resources a person at a node might use before leaving
+
+        Returns:
+            frozenset -- Names of the resources
+        """
+        return self.downstream_resources[node_id]
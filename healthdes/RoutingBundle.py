@@ -0,0 +1,290 @@
+""" HealthDES - A python library to support discrete event simulation in health and social care """
+
+import importlib
+import json
+import mmap
+import struct
+
+from types import MappingProxyType
+
+# Import local libraries
+# pylint: disable=relative-beyond-top-level
+from .Routing import Routing, Activity_ID
+
+# A bundle is a fixed header (magic, version, payload length) followed by a UTF-8 JSON payload
+BUNDLE_MAGIC = b'HDESRTB\x00'
+BUNDLE_VERSION = 1
+BUNDLE_HEADER = struct.Struct('<8sII')
+
+
+def _class_path(activity_class):
+    """Return the import path 'module:qualified name' for an activity class"""
+    return f'{activity_class.__module__}:{activity_class.__qualname__}'
+
+
+def _import_class(class_path):
+    """Import an activity class from its import path 'module:qualified name'"""
+    module_name, _, qualified_name = class_path.partition(':')
+    obj = importlib.import_module(module_name)
+    for attribute in qualified_name.split('.'):
+        obj = getattr(obj, attribute)
+    return obj
+
+
+def _survives_json(value):
+    """Return True if a value loads back from JSON unchanged
+
+    JSON turns the keys of dictionaries into strings and tuples into lists, other values which
+    are not JSON serialisable are rejected by json.dumps.
+    """
+    if isinstance(value, dict):
+        return all(isinstance(key, str) and _survives_json(item) for key, item in value.items())
+    if isinstance(value, tuple):
+        return False
+    if isinstance(value, list):
+        return all(_survives_json(item) for item in value)
+    return True
+
+
+def export_bundle(routing, path=None):
+    """Compile a routing graph into a routing bundle
+
+    The bundle holds the interned decision nodes, the edges as (starting node index, ending node
+    index, activity index, probability) and, for each activity, its name, the import path of its
+    class and its registered arguments. Arguments must be JSON serialisable and activity classes
+    must be importable by the processes loading the bundle (not defined in __main__).
+
+    Args:
+        routing (Routing): The routing graph to compile
+        path (str): If given, the bundle is also written to this file (default: None)
+
+    Raises:
+        ValueError: A decision node ID is not a string or number, or the arguments registered for
+                    an activity are not JSON serialisable, have keys that are not strings or
+                    hold tuples
+
+    Returns:
+        bytes: The routing bundle
+    """
+    nodes = list(routing.G.nodes)
+    for node_id in nodes:
+        # Other IDs, such as tuples, do not survive the JSON round trip unchanged
+        if isinstance(node_id, bool) or not isinstance(node_id, (str, int, float)):
+            raise ValueError(f'Routing cannot be compiled, decision node ID {node_id!r} must be '
+                             f'a string or number')
+    node_index = {node_id: i for i, node_id in enumerate(nodes)}
+
+    activity_names = list(routing.get_activities().keys())
+    activity_index = {name: i for i, name in enumerate(activity_names)}
+
+    activities = []
+    for name in activity_names:
+        activity_class, arguments = routing.get_activity_details(name)
+        if not _survives_json(dict(arguments)):
+            raise ValueError(f'Routing cannot be compiled, arguments of activity {name} must '
+                             f'only use string keys and lists, not tuples')
+        activities.append([name, _class_path(activity_class), dict(arguments)])
+
+    edges = []
+    for u, v, key, probability in routing.G.edges(keys=True, data='probability'):
+        edges.append([node_index[u], node_index[v], activity_index[key], probability])
+
+    try:
+        payload = json.dumps({'nodes': nodes, 'activities': activities, 'edges': edges},
+                             separators=(',', ':')).encode('utf-8')
+    except TypeError as error:
+        raise ValueError(f'Routing cannot be compiled, arguments must be JSON serialisable: '
+                         f'{error}')
+
+    bundle = BUNDLE_HEADER.pack(BUNDLE_MAGIC, BUNDLE_VERSION, len(payload)) + payload
+
+    if path is not None:
+        with open(path, 'wb') as file:
+            file.write(bundle)
+
+    return bundle
+
+
+def share_bundle(bundle, name=None):
+    """Copy a routing bundle into a shared memory block
+
+    The caller owns the block and must close() and unlink() it once the workers have loaded the
+    routing.
+
+    Args:
+        bundle (bytes): The routing bundle
+        name (str): Name of the shared memory block (default: a unique name chosen by the system)
+
+    Returns:
+        multiprocessing.shared_memory.SharedMemory: The shared memory block holding the bundle
+    """
+    from multiprocessing import shared_memory
+
+    block = shared_memory.SharedMemory(name=name, create=True, size=len(bundle))
+    block.buf[:len(bundle)] = bundle
+    return block
+
+
+class CompiledRouting:
+    """ Read-only routing loaded from a routing bundle
+
+    CompiledRouting provides the routing methods used while a simulation runs (get_activity,
+    get_activities, get_activity_details and get_routing_probabilities) without building a
+    networkx graph, so replication workers can load the routing from a file or shared memory
+    block written once by the parent process. Registered arguments are read-only.
+
+    Only the serialised bundle is shared between processes: each process decodes its own copy of
+    the routing when it loads the bundle, as Python objects cannot be shared between processes.
+
+    get_routing_probabilities and get_index rebuild the graph (see to_routing); the index is kept
+    once built.
+    """
+
+    def __init__(self, nodes, activities, edges):
+        """Create the routing from the decoded contents of a routing bundle
+
+        Arguments:
+            nodes {list} -- Decision node IDs
+            activities {list} -- [activity name, class import path, arguments] for each activity
+            edges {list} -- [starting node, ending node, activity, probability] indices
+        """
+        self.nodes = nodes
+
+        self.activities = {}
+        activity_names = []
+        for name, class_path, arguments in activities:
+            self.activities[name] = (_import_class(class_path), MappingProxyType(arguments))
+            activity_names.append(name)
+
+        self.edges = [(nodes[u], nodes[v], activity_names[a], probability)
+                      for u, v, a, probability in edges]
+
+        # RoutingIndex built on first use
+        self.index = None
+
+        # As Routing.get_activity, the last edge added from a node is the one taken
+        self.next_activity = {}
+        for u, v, name, _ in self.edges:
+            activity_class, arguments = self.activities[name]
+            self.next_activity[u] = Activity_ID(v, activity_class, arguments, name)
+
+    @classmethod
+    def from_bytes(cls, buffer):
+        """Load a routing from a bundle held in a bytes-like object
+
+        The routing is decoded into objects private to the calling process, the buffer is not
+        referenced once loaded.
+
+        Arguments:
+            buffer {bytes-like} -- bytes, memoryview, mmap or shared memory buffer
+
+        Raises:
+            ValueError: The buffer does not hold a supported routing bundle
+
+        Returns:
+            CompiledRouting -- The routing
+        """
+        magic, version, length = BUNDLE_HEADER.unpack_from(buffer, 0)
+        if magic != BUNDLE_MAGIC:
+            raise ValueError('Buffer does not hold a routing bundle')
+        if version != BUNDLE_VERSION:
+            raise ValueError(f'Unsupported routing bundle version: {version}')
+
+        start = BUNDLE_HEADER.size
+        payload = json.loads(bytes(buffer[start:start + length]).decode('utf-8'))
+
+        return cls(payload['nodes'], payload['activities'], payload['edges'])
+
+    @classmethod
+    def from_file(cls, path):
+        """Load a routing from a bundle file, memory mapped read-only
+
+        Arguments:
+            path {str} -- Path of the bundle file
+
+        Returns:
+            CompiledRouting -- The routing
+        """
+        with open(path, 'rb') as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                return cls.from_bytes(buffer)
+
+    @classmethod
+    def from_shared_memory(cls, name):
+        """Load a routing from a bundle in a shared memory block (see share_bundle)
+
+        Arguments:
+            name {str} -- Name of the shared memory block
+
+        Returns:
+            CompiledRouting -- The routing
+        """
+        from multiprocessing import shared_memory
+
+        block = shared_memory.SharedMemory(name=name)
+        try:
+            return cls.from_bytes(block.buf)
+        finally:
+            block.close()
+
+    def to_routing(self):
+        """Rebuild an editable Routing instance from the compiled routing
+
+        Returns:
+            Routing -- The routing graph
+        """
+        routing = Routing()
+        for node_id in self.nodes:
+            routing.add_decision(node_id)
+        for name, (activity_class, arguments) in self.activities.items():
+            routing.register_activity(name, activity_class, dict(arguments))
+        for u, v, name, probability in self.edges:
+            routing.add_activity(name, u, v, probability)
+
+        return routing
+
+    def get_activities(self):
+        """Get the list of registered activities
+
+        Returns:
+            Dictionary -- Dictionary of registered activities.
+        """
+        return self.activities
+
+    def get_activity_details(self, activity_name):
+        """Return a tuple containing the activity class and arguments
+
+        Arguments:
+            activity_name {string} -- Name of the activity
+
+        Returns:
+            (class obj, mapping) -- Class for the activity, read-only parameters to pass to
+                                    activity when instance created
+        """
+        return self.activities[activity_name]
+
+    def get_routing_probabilities(self):
+        """Return the probability of taking each activity when leaving its starting node
+
+        Returns:
+            Dictionary -- (starting node, ending node, activity name) -> probability
+        """
+        return self.to_routing().get_routing_probabilities()
+
+    def get_index(self):
+        """Return the reachability, expected visit and downstream resource index of the routing
+
+        Returns:
+            RoutingIndex -- The index
+        """
+        if self.index is None:
+            self.index = self.to_routing().get_index()
+
+        return self.index
+
+    def get_activity(self, node_id):
+        """Determine the next activity, return both the activity and next node ID"""
+        if node_id:
+            return self.next_activity[node_id]
+
+        return Activity_ID(None, None, None, None)
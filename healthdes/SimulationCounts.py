@@ -0,0 +1,36 @@
+""" HealthDES - A python library to support discrete event simulation in health and social care """
+
+import weakref
+
+
+class SimulationCounts:
+    """ Counts of people and activities in one simulation
+
+    Counts are kept for each simpy environment, so people still running when a replication stops
+    are not carried into the next replication run in the same process. The counts are discarded
+    with the environment.
+    """
+
+    # One set of counts for each simpy environment
+    _counts = weakref.WeakKeyDictionary()
+
+    def __init__(self):
+        self.persons_active = 0
+        self.persons_completed = 0
+        self.activities_active = 0
+
+    @classmethod
+    def for_env(cls, env):
+        """Return the counts for a simpy environment, creating them if needed
+
+        Arguments:
+            env {simpy.Environment} -- The simpy environment
+
+        Returns:
+            SimulationCounts -- The counts for the environment
+        """
+        counts = cls._counts.get(env, None)
+        if counts is None:
+            counts = cls()
+            cls._counts[env] = counts
+        return counts
@@ -0,0 +1,251 @@
+""" HealthDES - A python library to support discrete event simulation in health and social care """
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Fixed width record written for every person and activity state transition. States, messages
+# and activities are interned to integer IDs, -1 marks a missing value.
+TRACE_DTYPE = np.dtype([('time', '<f8'),
+                        ('pid', '<i8'),
+                        ('source', 'u1'),
+                        ('activity', '<i4'),
+                        ('state', '<i4'),
+                        ('message', '<i4')])
+
+TRACE_VERSION = 1
+
+# Values for the source field
+SOURCE_PERSON = 0
+SOURCE_ACTIVITY = 1
+SOURCE_NAMES = ['person', 'activity']
+
+
+def _ordered_records(records, count):
+    """Return the records written so far in the order they were written
+
+    If the buffer has not wrapped this is a view of the buffer (no copy), otherwise the two halves
+    of the ring buffer are concatenated.
+    """
+    capacity = len(records)
+    if count <= capacity:
+        return records[:count]
+
+    start = count % capacity
+    return np.concatenate((records[start:], records[:start]))
+
+
+def _records_to_dataframe(records, strings):
+    """Convert trace records to a DataFrame, decoding interned IDs to categorical columns"""
+    categories = pd.Index(strings, dtype=object)
+    return pd.DataFrame({
+        'time': records['time'],
+        'pid': records['pid'],
+        'source': pd.Categorical.from_codes(records['source'], categories=SOURCE_NAMES),
+        'activity': pd.Categorical.from_codes(records['activity'], categories=categories),
+        'state': pd.Categorical.from_codes(records['state'], categories=categories),
+        'message': pd.Categorical.from_codes(records['message'], categories=categories),
+    })
+
+
+class TraceRecorder:
+    """ Class to record person and activity state transitions as compact binary records
+
+    Tracing is opt-in: add the recorder to the simulation parameters under the key
+    'trace_recorder' and PersonBase and ActivityBase will record each transition of their state
+    machines. Each transition is stored as a fixed width record (see TRACE_DTYPE) with states,
+    messages and activities interned to integer IDs.
+
+    Without a path the records are held in a preallocated in-memory ring buffer which keeps the
+    most recent 'capacity' records. With a path the records are written to an append-only memory
+    mapped file which grows by 'capacity' records whenever it fills. Call close() (or flush()) to
+    write the sidecar file '<path>.json' holding the string table, after which the trace may be
+    opened with TraceReader.
+    """
+
+    def __init__(self, capacity=1000000, path=None):
+        """Create a trace recorder
+
+        Args:
+            capacity (int): Number of records in the ring buffer, or the number of records by which
+                            the trace file grows (default: 1000000)
+            path (str): Path of the trace file, if None the trace is held in memory
+                        (default: None)
+
+        Raises:
+            ValueError: The capacity is not greater than zero
+        """
+        if not (isinstance(capacity, int) and capacity > 0):
+            raise ValueError('capacity must be an integer greater than zero')
+
+        self.capacity = capacity
+        self.path = path
+        self.count = 0
+        self.closed = False
+
+        # Interned strings, the ID is the index into the list of strings
+        self.string_ids = {None: -1}
+        self.strings = []
+
+        if path is None:
+            self.records = np.zeros(capacity, dtype=TRACE_DTYPE)
+        else:
+            self.records = np.memmap(path, dtype=TRACE_DTYPE, mode='w+', shape=(capacity,))
+
+    def intern(self, name):
+        """Return the integer ID for a state, message or activity name
+
+        Args:
+            name (str): The name to intern
+
+        Returns:
+            int: ID of the name in the string table
+        """
+        string_id = self.string_ids.get(name, None)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(name)
+            self.string_ids[name] = string_id
+        return string_id
+
+    def record(self, time, pid, source, activity, state, message):
+        """Record a state transition
+
+        Args:
+            time (float): Simulation time of the transition
+            pid (int): Person ID
+            source (int): SOURCE_PERSON or SOURCE_ACTIVITY
+            activity (str): Name of the activity (or None)
+            state (str): State the transition is from
+            message (str): Message received that triggers the transition
+
+        Raises:
+            ValueError: The trace has been closed
+        """
+        if self.closed:
+            raise ValueError('Cannot record to a closed trace')
+
+        capacity = len(self.records)
+        if self.path is not None and self.count == capacity:
+            self._grow_file()
+            capacity = len(self.records)
+
+        self.records[self.count % capacity] = (time, pid, source,
+                                               self.intern(activity),
+                                               self.intern(state),
+                                               self.intern(message))
+        self.count += 1
+
+    def _grow_file(self):
+        """Extend the trace file by 'capacity' records and map the larger file"""
+        size = len(self.records) + self.capacity
+        self.records.flush()
+        del self.records
+        with open(self.path, 'r+b') as file:
+            file.truncate(size * TRACE_DTYPE.itemsize)
+        self.records = np.memmap(self.path, dtype=TRACE_DTYPE, mode='r+', shape=(size,))
+
+    def get_records(self):
+        """Return the records in the order written
+
+        Returns:
+            numpy structured array: Trace records with dtype TRACE_DTYPE
+        """
+        return _ordered_records(self.records, self.count)
+
+    def to_dataframe(self):
+        """Return the trace as a pandas DataFrame with decoded names
+
+        Returns:
+            DataFrame: One row per recorded transition
+        """
+        return _records_to_dataframe(self.get_records(), self.strings)
+
+    def flush(self):
+        """Flush the trace file and write the sidecar file holding the string table"""
+        if self.path is None:
+            return
+
+        self.records.flush()
+        self._write_header()
+
+    def close(self):
+        """Flush the trace and trim the trace file to the records written
+
+        The records remain readable, further transitions cannot be recorded.
+        """
+        self.closed = True
+        if self.path is None:
+            return
+
+        self.records.flush()
+        if self.count < len(self.records):
+            del self.records
+            with open(self.path, 'r+b') as file:
+                file.truncate(self.count * TRACE_DTYPE.itemsize)
+            if self.count > 0:
+                self.records = np.memmap(self.path, dtype=TRACE_DTYPE, mode='r',
+                                         shape=(self.count,))
+            else:
+                self.records = np.zeros(0, dtype=TRACE_DTYPE)
+        self._write_header()
+
+    def _write_header(self):
+        """Write the sidecar file describing the trace file"""
+        header = {'version': TRACE_VERSION,
+                  'dtype': TRACE_DTYPE.descr,
+                  'count': self.count,
+                  'strings': self.strings}
+        with open(self.path + '.json', 'w') as file:
+            json.dump(header, file)
+
+
+class TraceReader:
+    """ Class to read a trace file written by TraceRecorder
+
+    The trace file is memory mapped read-only, records are returned as views of the mapped file
+    without copying.
+    """
+
+    def __init__(self, path):
+        """Open a trace file
+
+        Args:
+            path (str): Path of the trace file (the sidecar '<path>.json' must also exist)
+
+        Raises:
+            ValueError: The trace file version is not supported
+        """
+        with open(path + '.json', 'r') as file:
+            header = json.load(file)
+
+        if header.get('version', None) != TRACE_VERSION:
+            raise ValueError(f'Unsupported trace version: {header.get("version", None)}')
+
+        self.path = path
+        self.count = header['count']
+        self.strings = header['strings']
+
+        records = os.path.getsize(path) // TRACE_DTYPE.itemsize
+        if records:
+            self.records = np.memmap(path, dtype=TRACE_DTYPE, mode='r', shape=(records,))
+        else:
+            self.records = np.zeros(0, dtype=TRACE_DTYPE)
+
+    def get_records(self):
+        """Return the records in the order written
+
+        Returns:
+            numpy structured array: Trace records with dtype TRACE_DTYPE
+        """
+        return self.records[:self.count]
+
+    def to_dataframe(self):
+        """Return the trace as a pandas DataFrame with decoded names
+
+        Returns:
+            DataFrame: One row per recorded transition
+        """
+        return _records_to_dataframe(self.get_records(), self.strings)
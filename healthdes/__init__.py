@@ -2,19 +2,61 @@
 # flake8: noqa
 
 from .ActivityBase import ActivityBase
+from .ActivityContext import ActivityContext, ActivityContextPool
 from .DataCollection import DataCollection
 from .DecisionBase import DecisionBase
+from .JobService import (JobCancelled, ProgressReporter, SimulationJob, SimulationJobService,
+                         serve_jobs)
+from .Journey import JourneyRecorder
+from .Memory import MemoryMonitor
+from .Partition import find_partitions, run_partitioned
 from .PersonBase import PersonBase
+from .QueueingNetwork import QueueingNetwork
+from .RandomStreams import RandomStream, RandomStreams, compare_scenarios, run_replications
 from .ResourceBase import ResourceBase
-from .Routing import Routing, Activity_ID
-from .Check import CheckList, Check
+from .ResultsStore import ResultsStore
+from .ResultTransport import export_results, gather_results, gather_counters
+from .Routing import Routing, RoutingIndex, Activity_ID
+from .RoutingBundle import CompiledRouting, export_bundle, share_bundle
+from .SimulationCounts import SimulationCounts
+from .Check import ArrayCheckError, Check, CheckArray, CheckList
+from .Trace import TraceRecorder, TraceReader
 
 __all__ = ['ActivityBase',
+           'ActivityContext',
+           'ActivityContextPool',
            'Activity_ID',
+           'ArrayCheckError',
            'Check',
+           'CheckArray',
            'CheckList',
+           'CompiledRouting',
            'DataCollection',
            'DecisionBase',
+           'JobCancelled',
+           'JourneyRecorder',
+           'MemoryMonitor',
            'PersonBase',
+           'ProgressReporter',
+           'QueueingNetwork',
+           'RandomStream',
+           'RandomStreams',
            'ResourceBase',
-           'Routing']
+           'ResultsStore',
+           'Routing',
+           'RoutingIndex',
+           'SimulationCounts',
+           'SimulationJob',
+           'SimulationJobService',
+           'TraceReader',
+           'TraceRecorder',
+           'compare_scenarios',
+           'export_bundle',
+           'export_results',
+           'find_partitions',
+           'gather_counters',
+           'gather_results',
+           'run_partitioned',
+           'run_replications',
+           'serve_jobs',
+           'share_bundle']
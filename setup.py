@@ -26,5 +26,6 @@ setuptools.setup(
     python_requires='>=3.7',
     install_requires=['simpy>=4',
                       'networkx>=2',
-                      'pandas>=1']
+                      'pandas>=1',
+                      'numpy']
 )
\ No newline at end of file